@@ -1,16 +1,22 @@
 import pygame
 import random
 import numpy as np
-import winsound
-import json
+try:
+    import winsound
+except ImportError:  # 非 Windows 平台沒有 winsound，提示音改為不發聲
+    winsound = None
 import os
-
-pygame.init()
+import threading
+import time
+import metrics
+from resample import interpolate_points
+from dataset_writer import SessionWriter
+from raw_archive import RawArchiveWriter
+from capture import MotionBuffer, CaptureStats, event_times
 
 # 視窗大小
 WIDTH, HEIGHT = 800, 600
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Mouse Trajectory Collector")
+WIN = None  # 視窗與字型在 init_display() 才建立，匯入本模組不會開視窗
 
 # 顏色
 WHITE = (230, 230, 230)
@@ -19,10 +25,19 @@ COLORS = [(255, 0, 0), (0, 200, 0), (0, 0, 255), (255, 165, 0), (200, 0, 200)]
 TRAJ_COLOR = (100, 100, 255)  # 即時軌跡顏色
 POINT_COLOR = (255, 0, 200)   # 點顏色
 
+RENDER_FPS = 60  # 繪圖幀率；取樣不受此限制
+
 RADIUS = 20  # 小球參數
 POINT_RADIUS = 6  # 點半徑
 
-last_saved_count = 0  
+session_writer = None
+raw_writer = None
+session_raw = []    # 最近一次 collect_data 的完整取樣，與回傳的 dataset 一一對應
+
+def beep(freq, duration):
+    # winsound.Beep 會阻塞到播完，放到背景執行緒，避免收集中途卡住事件迴圈
+    if winsound is not None:
+        threading.Thread(target=winsound.Beep, args=(freq, duration), daemon=True).start()
 
 def load_cjk_font(size=20):
     candidates_path = [
@@ -47,65 +62,36 @@ def load_cjk_font(size=20):
             continue
     return pygame.font.SysFont(None, size)
 
-font = load_cjk_font(20)
+font = None
+
+def init_display():
+    # 從 main.py 呼叫時沿用主選單的視窗，單獨執行時才自己開一個
+    global WIN, font
+    pygame.init()
+    WIN = pygame.display.get_surface()
+    if WIN is None:
+        WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+        pygame.display.set_caption("Mouse Trajectory Collector")
+    if font is None:
+        font = load_cjk_font(20)
 
 def draw_ball(pos, color, radius=RADIUS):
     pygame.draw.circle(WIN, color, pos, radius)
 
-def interpolate_points(points, num=10):
-    if len(points) < 2:
-        return np.zeros((num, 2))
-
-    dists = [0]
-    for i in range(1, len(points)):
-        dx = points[i][0] - points[i-1][0]
-        dy = points[i][1] - points[i-1][1]
-        dists.append(dists[-1] + (dx**2 + dy**2) ** 0.5)
-
-    total_dist = dists[-1]
-    if total_dist == 0:
-        return np.zeros((num, 2))
-
-    targets = np.linspace(0, total_dist, num)
-    new_points = []
-    j = 0
-    for t in targets:
-        while j < len(dists)-1 and dists[j+1] < t:
-            j += 1
-        if j == len(dists)-1:
-            new_points.append(points[-1])
-        else:
-            ratio = (t - dists[j]) / (dists[j+1] - dists[j] + 1e-8)
-            x = points[j][0] + ratio * (points[j+1][0] - points[j][0])
-            y = points[j][1] + ratio * (points[j+1][1] - points[j][1])
-            new_points.append((x, y))
-
-    return np.array(new_points)
-
-def truncate_last_lines(filename, n):
-    if n <= 0 or not os.path.exists(filename):
-        return
-    with open(filename, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    if n > len(lines):
-        n = len(lines)
-    with open(filename, "w", encoding="utf-8") as f:
-        f.writelines(lines[:-n])
-
-def save_json(dataset, filename="mouse_dataset.jsonl"):
-    global last_saved_count
-    truncate_last_lines(filename, last_saved_count)
-
-    with open(filename, "a", encoding="utf-8") as f:
-        for (dx_dy, traj_rel) in dataset:
-            dx, dy = dx_dy
-            record = {
-                "relative_move": {"dx": int(round(dx)), "dy": int(round(dy))},
-                "trajectory": [[int(round(x)), int(round(y))] for x, y in traj_rel]
-            }
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-    last_saved_count = len(dataset)
+def start_session(filename="mouse_dataset.jsonl"):
+    # 每次開始收集時記下檔案目前長度，之後的存檔只會動到這之後的資料
+    global session_writer, raw_writer
+    session_writer = SessionWriter(filename)
+    raw_writer = RawArchiveWriter(filename)
+    return session_writer
+
+def save_json(dataset, filename="mouse_dataset.jsonl", raw=None):
+    # raw: 與 dataset 對應的完整取樣 [(points, times), ...]，另存到 <name>.raw 封存檔
+    if session_writer is None or session_writer.filename != filename:
+        start_session(filename)
+    session_writer.save(dataset)
+    if raw is not None:
+        raw_writer.save(raw, session_writer.record_links())
     print(f"{len(dataset)} samples saved -> {filename}")
 
 def draw_instructions():
@@ -125,8 +111,10 @@ def rel_to_abs_points(traj_rel):
     arr = np.array(traj_rel, dtype=float) + center
     return arr
 
-def collect_data():
-    clock = pygame.time.Clock()
+def collect_data(filename="mouse_dataset.jsonl"):
+    global session_raw
+    init_display()
+    start_session(filename)
     run = True
     ball_pos = (WIDTH // 2, HEIGHT // 2)
     ball_color = COLORS[0]
@@ -134,43 +122,79 @@ def collect_data():
     target_color = None
 
     collecting = False
-    trajectory = []
+    stroke_start = 0.0
+    trajectory = MotionBuffer()
     traj_points = None
 
     dataset = []
+    raw = session_raw = []
     undone = []
 
-    while run:
-        WIN.fill(BG_COLOR)
-
-        draw_ball(ball_pos, ball_color)
-        if target_pos:
-            draw_ball(target_pos, target_color)
+    # 取樣由 MOUSEMOTION 事件驅動，繪圖另外以 RENDER_FPS 排程；等待事件時一有輸入就醒來
+    frame_interval = 1.0 / RENDER_FPS
+    stats = CaptureStats(frame_interval)
+    next_frame = time.perf_counter()
+    polled = next_frame
 
-        # 即時軌跡
-        if len(trajectory) > 1:
-            pygame.draw.lines(WIN, TRAJ_COLOR, False, trajectory, 2)
-
-        # 切分點
-        if traj_points is not None:
-            for x, y in traj_points:
-                draw_ball((int(x), int(y)), POINT_COLOR, POINT_RADIUS)
-
-        draw_instructions()
-        pygame.display.update()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+    while run:
+        frame_start = time.perf_counter()
+        if frame_start >= next_frame:
+            WIN.fill(BG_COLOR)
+
+            draw_ball(ball_pos, ball_color)
+            if target_pos:
+                draw_ball(target_pos, target_color)
+
+            # 即時軌跡
+            if len(trajectory) > 1:
+                pygame.draw.lines(WIN, TRAJ_COLOR, False, trajectory.points(), 2)
+
+            # 切分點
+            if traj_points is not None:
+                for x, y in traj_points:
+                    draw_ball((int(x), int(y)), POINT_COLOR, POINT_RADIUS)
+
+            draw_instructions()
+            WIN.blit(font.render(stats.text(), True, WHITE), (10, HEIGHT - 30))
+            pygame.display.update()
+
+            frame_end = time.perf_counter()
+            metrics.record("frame.collect", frame_end - frame_start, frame_start)
+            next_frame = stats.frame(next_frame, frame_end)
+
+        timeout_ms = max(1, int((next_frame - time.perf_counter()) * 1000))
+        stats.away(time.perf_counter() - polled, collecting)
+        previous_poll = polled
+        first = pygame.event.wait(timeout_ms)
+        polled = time.perf_counter()
+        ticks = pygame.time.get_ticks()
+        events = pygame.event.get()
+        if first.type != pygame.NOEVENT:
+            events.insert(0, first)
+        motion_times = event_times([e for e in events if e.type == pygame.MOUSEMOTION], previous_poll, polled, ticks)
+
+        captured = 0
+        motions = 0
+        was_collecting = collecting
+        for event in events:
+            if event.type == pygame.MOUSEMOTION:
+                if collecting:
+                    trajectory.append(event.pos[0], event.pos[1], motion_times[motions])
+                    captured += 1
+                motions += 1
+
+            elif event.type == pygame.QUIT:
                 run = False
 
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_s:
-                    save_json(dataset)
+                    save_json(dataset, filename, raw)
                 elif event.key == pygame.K_ESCAPE:
                     run = False
                 elif event.key in (pygame.K_z, pygame.K_d):  # 撤銷 Undo
                     if dataset:
                         item = dataset.pop()
+                        raw.pop()
                         undone.append(item)
                         if dataset:
                             last_rel = dataset[-1][1]
@@ -178,14 +202,14 @@ def collect_data():
                         else:
                             traj_points = None
                         collecting = False
-                        trajectory = []
+                        trajectory.clear()
                         target_pos = None
                         target_color = None
-                        winsound.Beep(400, 200)
+                        beep(400, 200)
                         print("Undo")
 
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                mx, my = pygame.mouse.get_pos()
+                mx, my = event.pos
 
                 if (mx - ball_pos[0])**2 + (my - ball_pos[1])**2 <= RADIUS**2 and not target_pos:
                     ball_pos = (mx, my)
@@ -201,37 +225,43 @@ def collect_data():
                     target_pos = (max(50, min(WIDTH-50, tx)), max(50, min(HEIGHT-50, ty)))
                     target_color = random.choice(COLORS[1:])
                     collecting = True
-                    trajectory = []
+                    stroke_start = polled
+                    trajectory.clear()
+                    trajectory.append(mx, my, polled)
                     traj_points = None
-                    winsound.Beep(800, 150)
+                    beep(800, 150)
 
                 elif target_pos and (mx - target_pos[0])**2 + (my - target_pos[1])**2 <= RADIUS**2:
                     collecting = False
-                    interp = interpolate_points(trajectory, num=10) 
+                    trajectory.append(mx, my, polled)
+                    with metrics.timer("resample.single"):
+                        interp = interpolate_points(trajectory.points(), num=10)
                     traj_points = interp.copy() 
                     traj_rel = (interp - np.array(ball_pos)).tolist() 
 
                     dx = mx - ball_pos[0]
                     dy = my - ball_pos[1]
                     dataset.append(((dx, dy), traj_rel))
+                    raw.append((trajectory.points().copy(), trajectory.times().copy()))
                     undone.clear()
 
-                    winsound.Beep(1200, 200)
+                    beep(1200, 200)
 
                     ball_pos = (WIDTH // 2, HEIGHT // 2)
                     ball_color = COLORS[0]
                     target_pos = None
                     target_color = None
 
-        if collecting:
-            mx, my = pygame.mouse.get_pos()
-            trajectory.append((mx, my))
-
-        clock.tick(240)
+        stats.poll(polled, captured, was_collecting or collecting, stroke_start)
+        metrics.count("capture.samples", captured)
 
+    summary = stats.summary()
+    print(f"Capture: {summary['samples']} samples, {summary['samples_per_s']:.0f} samples/s while collecting, "
+          f"{summary['frames']} frames, {summary['dropped_frames']} dropped, "
+          f"max poll gap {summary['max_poll_gap_ms']:.1f} ms")
     return dataset
 
 if __name__ == "__main__":
     data = collect_data()
-    save_json(data)
+    save_json(data, raw=session_raw)
     pygame.quit()
@@ -0,0 +1,187 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from dataset_cache import dataset_digest
+
+# 模型產物快取：以 資料內容雜湊 + 訓練超參數 + 網路結構 為 key，保存每次訓練輸出的 ONNX 與附屬檔
+#   model_cache/<key>/  mouse_traj.onnx、.onnx.data、.npz、.opt/.int8.onnx、.variants.json、.grid.*、.ckpt.pt
+#                       meta.json (設定、資料雜湊、驗證 loss、建立 / 最後使用時間、大小)
+# 資料與設定都沒變時 train_model 直接把快取的版本複製回工作目錄，不必重新訓練；
+# 測試頁面可以在快取中的各版本間切換比較。總大小或版本數超過上限時依最後使用時間 (LRU) 淘汰
+#   python artifact_cache.py list | use <key> | clear
+
+CACHE_DIR = "model_cache"
+KEY_VERSION = 1  # 訓練 / 匯出流程改變 (同樣輸入會得到不同模型) 時調高，讓舊的 key 全部失效
+MAX_MB = 1024
+MAX_ENTRIES = 20
+# 相對於 <base> 的檔名；.onnx.data 是 onnx 以檔名參照的外部權重，複製時必須保持原檔名
+ARTIFACT_SUFFIXES = (".onnx", ".onnx.data", ".npz", ".opt.onnx", ".opt.onnx.data", ".int8.onnx",
+                     ".int8.onnx.data", ".variants.json", ".grid.npy", ".grid.json", ".ckpt.pt")
+
+def cache_dir_for(save_path):
+    return os.path.join(os.path.dirname(os.path.abspath(save_path)), CACHE_DIR)
+
+def artifact_paths(save_path):
+    base = os.path.splitext(save_path)[0]
+    return [base + suffix for suffix in ARTIFACT_SUFFIXES]
+
+def architecture(hidden, normalize):
+    # 不 import torch：TrajNet 是 2 -> hidden... -> 20 的全連接 + ReLU
+    widths = [2] + list(hidden) + [20]
+    return {"layers": [[a, b] for a, b in zip(widths, widths[1:])], "activation": "relu",
+            "normalize": bool(normalize)}
+
+def cache_key(jsonl_file, save_path, config):
+    # config: 會影響輸出模型的 train_model 參數 (需含 hidden / normalize)；num_threads 等只影響速度的不算
+    files = [jsonl_file] if isinstance(jsonl_file, str) else list(jsonl_file)
+    payload = {"version": KEY_VERSION, "datasets": [dataset_digest(f) for f in files], "config": config,
+               "architecture": architecture(config["hidden"], config["normalize"]),
+               "model": os.path.basename(save_path)}
+    blob = json.dumps(payload, sort_keys=True).encode("utf-8")
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def _copy(src, dst):
+    tmp = dst + ".tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+class ArtifactCache:
+    def __init__(self, root=CACHE_DIR, max_mb=MAX_MB, max_entries=MAX_ENTRIES):
+        self.root = root
+        self.max_bytes = max_mb << 20
+        self.max_entries = max_entries
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def model_path(self, meta):
+        return os.path.join(self.entry_dir(meta["key"]), meta["model"])
+
+    def _meta(self, key):
+        try:
+            with open(os.path.join(self.entry_dir(key), "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 檔案被手動刪掉的版本視同不存在
+        if not all(os.path.exists(os.path.join(self.entry_dir(key), name)) for name in meta.get("files", ())):
+            return None
+        return meta
+
+    def entries(self):
+        # 新建立的在前
+        if not os.path.isdir(self.root):
+            return []
+        metas = [self._meta(name) for name in os.listdir(self.root) if not name.endswith(".tmp")]
+        return sorted((m for m in metas if m is not None), key=lambda m: m["created"], reverse=True)
+
+    def touch(self, key):
+        meta = self._meta(key)
+        if meta is not None:
+            meta["last_used"] = time.time()
+            _write_json(os.path.join(self.entry_dir(key), "meta.json"), meta)
+        return meta
+
+    def lookup(self, key):
+        return self.touch(key)
+
+    def store(self, key, save_path, files, info=None):
+        # files: 這次訓練實際寫出的產物 (工作目錄中上次留下的版本 / 網格不算)，複製進快取；
+        # 先寫到暫存目錄再改名，訓練行程與 GUI 同時讀寫也不會看到半套
+        names = {os.path.basename(p) for p in artifact_paths(save_path)}
+        files = [p for p in dict.fromkeys(files) if os.path.basename(p) in names and os.path.exists(p)]
+        tmp_dir = self.entry_dir(key) + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for path in files:
+            shutil.copyfile(path, os.path.join(tmp_dir, os.path.basename(path)))
+        now = time.time()
+        meta = dict(info or {}, key=key, model=os.path.basename(save_path),
+                    files=[os.path.basename(p) for p in files], created=now, last_used=now,
+                    bytes=sum(os.path.getsize(p) for p in files))
+        _write_json(os.path.join(tmp_dir, "meta.json"), meta)
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        os.replace(tmp_dir, self.entry_dir(key))
+        self.evict(keep=key)
+        return meta
+
+    def restore(self, key, save_path):
+        # 把快取的版本複製回工作路徑；該版本沒有的產物 (例如當時沒產生網格) 從工作目錄移除，免得混用舊檔
+        meta = self.touch(key)
+        if meta is None:
+            return None
+        for path in artifact_paths(save_path):
+            name = os.path.basename(path)
+            if name in meta["files"]:
+                _copy(os.path.join(self.entry_dir(key), name), path)
+            elif os.path.exists(path):
+                os.remove(path)
+        return meta
+
+    def remove(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def evict(self, keep=None):
+        # 依 last_used 由舊到新淘汰，直到總大小與版本數都在上限內；剛存入的 keep 不會被淘汰
+        entries = sorted(self.entries(), key=lambda m: m["last_used"])
+        total = sum(m["bytes"] for m in entries)
+        count = len(entries)
+        removed = []
+        for meta in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            if meta["key"] == keep:
+                continue
+            self.remove(meta["key"])
+            total -= meta["bytes"]
+            count -= 1
+            removed.append(meta["key"])
+        return removed
+
+def describe(meta):
+    config = meta.get("config", {})
+    hidden = "-".join(str(h) for h in config.get("hidden", ()))
+    created = time.strftime("%m-%d %H:%M", time.localtime(meta["created"]))
+    text = f"{created} {hidden} lr={config.get('lr')} bs={config.get('batch_size')} n={meta.get('records', '?')}"
+    if meta.get("val_loss") is not None:
+        text += f" val={meta['val_loss']:.3f}"
+    return text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List, restore or clear cached model versions")
+    parser.add_argument("command", nargs="?", default="list", choices=("list", "use", "clear"))
+    parser.add_argument("key", nargs="?", help="key (or unique prefix) of the version to restore for 'use'")
+    parser.add_argument("--model", default="mouse_traj.onnx", help="working model path")
+    args = parser.parse_args(argv)
+    cache = ArtifactCache(cache_dir_for(args.model))
+    entries = cache.entries()
+    if args.command == "clear":
+        for meta in entries:
+            cache.remove(meta["key"])
+        print(f"Removed {len(entries)} cached versions")
+    elif args.command == "use":
+        matches = [m for m in entries if args.key and m["key"].startswith(args.key)]
+        if len(matches) != 1:
+            print(f"No unique cached version matches {args.key!r}")
+            return 1
+        cache.restore(matches[0]["key"], args.model)
+        print(f"Restored {matches[0]['key'][:12]} -> {args.model}")
+    else:
+        for meta in entries:
+            print(f"{meta['key'][:12]}  {meta['bytes'] / 2 ** 20:7.1f} MB  {describe(meta)}")
+        print(f"{len(entries)} versions, {sum(m['bytes'] for m in entries) / 2 ** 20:.1f} MB in {cache.root}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,440 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from resample import interpolate_points, interpolate_batch
+from dataset_writer import format_record
+from raw_archive import RawArchive, RawArchiveWriter, archive_paths
+
+# 不需要顯示器的效能測試：收集 (重切軌跡) → 載入資料 → 訓練 → 推理
+# 結果寫成 JSON，可用 --compare 比較兩次結果並標出變慢的項目
+#   python benchmark.py --sizes 1000,10000,100000,1000000 --out bench.json
+#   python benchmark.py --compare old.json new.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ===================== 合成資料 =====================
+def make_raw_trajectories(n, seed=0, min_len=20, max_len=200):
+    # 朝目標點前進的隨機漫步，回傳 (flat points, offsets, moves)
+    rng = np.random.default_rng(seed)
+    moves = rng.integers(-350, 351, size=(n, 2))
+    lengths = rng.integers(min_len, max_len + 1, size=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    traj_id = np.repeat(np.arange(n), lengths)
+    step = np.arange(offsets[-1]) - offsets[traj_id]
+    t = step / (lengths[traj_id] - 1)
+    ease = t * t * (3 - 2 * t)
+    noise = rng.normal(0, 2.0, size=(offsets[-1], 2)) * np.sin(np.pi * t)[:, None]
+    points = np.rint(moves[traj_id] * ease[:, None] + noise)
+    return points, offsets, moves
+
+def write_synthetic_jsonl(path, n, seed=0, chunk=100000):
+    with open(path, "wb") as f:
+        for start in range(0, n, chunk):
+            m = min(chunk, n - start)
+            points, offsets, moves = make_raw_trajectories(m, seed + start)
+            trajs = interpolate_batch(points, offsets, num=10)
+            f.write(b"".join(format_record(move, traj) for move, traj in zip(moves, trajs)))
+    return path
+
+# ===================== 個別項目 =====================
+def bench_resample(n, single_limit=2000):
+    points, offsets, _ = make_raw_trajectories(n)
+    start = time.perf_counter()
+    interpolate_batch(points, offsets, num=10)
+    batch_s = time.perf_counter() - start
+
+    m = min(n, single_limit)
+    trajs = [points[offsets[i]:offsets[i + 1]] for i in range(m)]
+    start = time.perf_counter()
+    for traj in trajs:
+        interpolate_points(traj, num=10)
+    single_s = time.perf_counter() - start
+    return {"batch_traj_per_s": n / batch_s, "single_traj_per_s": m / single_s}
+
+_LOAD_CHILD = r"""
+import json, sys, time
+sys.path.insert(0, {here!r})
+import numpy as np
+import dataset_cache
+mode, path = {mode!r}, {path!r}
+start = time.perf_counter()
+if mode == "parse":
+    inputs, targets = dataset_cache.load_arrays(path, use_cache=False)
+elif mode == "build":
+    dataset_cache.build_cache(path)
+    inputs, targets = dataset_cache.load_arrays(path)
+else:
+    inputs, targets = dataset_cache.load_arrays(path)
+open_s = time.perf_counter() - start
+total = float(np.asarray(inputs).sum() + np.asarray(targets).sum())
+touch_s = time.perf_counter() - start
+peak_mb = None
+try:
+    # Linux 的 ru_maxrss 會從父行程繼承過 exec，VmHWM 才是本行程自己的峰值
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                peak_mb = int(line.split()[1]) / 1024
+except OSError:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+    except ImportError:
+        pass
+sys.__stdout__.write(json.dumps({{"open_s": open_s, "touch_s": touch_s, "peak_rss_mb": peak_mb}}) + "\n")
+"""
+
+def _run_child(code):
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def bench_load(path):
+    # 每種方式在獨立子行程量測，peak RSS 才不會互相影響
+    result = {}
+    for mode in ("parse", "build", "mmap"):
+        stats = _run_child(_LOAD_CHILD.format(here=HERE, mode=mode, path=path))
+        result[f"{mode}_open_s"] = stats["open_s"]
+        result[f"{mode}_touch_s"] = stats["touch_s"]
+        result[f"{mode}_peak_rss_mb"] = stats["peak_rss_mb"]
+    return result
+
+def bench_train(path, workdir, epochs=1, batch_size=32):
+    import train_model
+    epochs_info = []
+    start = time.perf_counter()
+    save_path = os.path.join(workdir, "bench_traj.onnx")
+    train_model.train_model(path, save_path=save_path, epochs=epochs, batch_size=batch_size, cache=False,
+                            progress=lambda msg: msg["type"] == "epoch" and epochs_info.append(msg))
+    rates = [e["samples_per_s"] for e in epochs_info]
+    return {"samples_per_s": float(np.mean(rates)), "epoch_samples_per_s": rates,
+            "total_s": time.perf_counter() - start}, save_path
+
+def bench_normalization(path, workdir, epochs=30, batch_size=32, target=None):
+    # 原始像素 vs 正規化：各訓練 epochs 個 epoch (不提前停止)，量到達目標驗證 loss 所需的 epoch 數與時間
+    # 目標預設為原始設定整段訓練中最佳驗證 loss 的 1.05 倍
+    import train_model
+    curves = {}
+    for name, normalize in (("raw", False), ("normalized", True)):
+        vals, times = [], []
+        start = time.perf_counter()
+
+        def progress(msg):
+            if msg["type"] == "epoch":
+                vals.append(msg["val_loss"])
+                times.append(time.perf_counter() - start)
+        train_model.train_model(path, save_path=os.path.join(workdir, f"norm_{name}.onnx"), epochs=epochs,
+                                batch_size=batch_size, patience=0, resume=False, variants=False, grid=False,
+                                normalize=normalize, progress=progress, cache=False)
+        curves[name] = (vals, times)
+    target = target if target is not None else 1.05 * min(curves["raw"][0])
+    result = {"target_val_loss": target, "epochs": epochs}
+    for name, (vals, times) in curves.items():
+        hit = next((i for i, v in enumerate(vals) if v <= target), None)
+        result[name] = {"best_val_loss": min(vals), "final_val_loss": vals[-1],
+                        "epochs_to_target": None if hit is None else hit + 1,
+                        "seconds_to_target": None if hit is None else times[hit], "val_curve": vals}
+    return result
+
+def _percentiles(samples_us):
+    p50, p95, p99 = np.percentile(samples_us, [50, 95, 99])
+    return {"p50_us": p50, "p95_us": p95, "p99_us": p99}
+
+def bench_inference(model_path, single_calls=5000, batch_sizes=(1024, 65536)):
+    import test_model
+    import numpy_backend
+    rng = np.random.default_rng(0)
+    result = {}
+
+    start = time.perf_counter()
+    test_model.InferenceEngine(model_path).close()
+    result["session_create_s"] = time.perf_counter() - start
+
+    engine = test_model.get_engine(model_path)
+    engine.predict(1, 1)
+    moves = rng.integers(-350, 351, size=(single_calls, 2))
+    lat = np.empty(single_calls)
+    for i, (dx, dy) in enumerate(moves):
+        t = time.perf_counter()
+        engine.predict(dx, dy)
+        lat[i] = (time.perf_counter() - t) * 1e6
+    result["onnx_single"] = _percentiles(lat)
+
+    npz_path = os.path.splitext(model_path)[0] + ".npz"
+    if not os.path.exists(npz_path):
+        numpy_backend.export_npz(model_path, npz_path)
+    net = numpy_backend.NumpyTrajNet(npz_path)
+    for i, (dx, dy) in enumerate(moves):
+        t = time.perf_counter()
+        net.predict(dx, dy)
+        lat[i] = (time.perf_counter() - t) * 1e6
+    result["numpy_single"] = _percentiles(lat)
+
+    for size in batch_sizes:
+        batch = rng.uniform(-350, 350, size=(size, 2)).astype(np.float32)
+        engine.predict_batch(batch)
+        t = time.perf_counter()
+        engine.predict_batch(batch)
+        result[f"onnx_batch{size}_per_s"] = size / (time.perf_counter() - t)
+        t = time.perf_counter()
+        net.predict_batch(batch)
+        result[f"numpy_batch{size}_per_s"] = size / (time.perf_counter() - t)
+    engine.close()
+    return result
+
+def bench_retrieval(path, model_path=None, single_calls=2000, batch=65536, k=8):
+    # 在訓練集上建索引、以驗證集查詢；有模型時同一份驗證集也跑 NumPy MLP 做比較
+    import tracemalloc
+    import dataset_cache
+    import retrieval_backend
+    inputs, targets = dataset_cache.load_arrays(path)
+    train_idx, val_idx = dataset_cache.split_indices(len(inputs))
+    val_in = np.asarray(inputs[val_idx], dtype=np.float32)
+    val_tgt = np.asarray(targets[val_idx], dtype=np.float32).reshape(-1, 10, 2)
+    train_in, train_tgt = inputs[train_idx], targets[train_idx]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    net = retrieval_backend.RetrievalTrajNet.from_arrays(train_in, train_tgt, k=k)
+    build_s = time.perf_counter() - start
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rng = np.random.default_rng(0)
+    queries = val_in[rng.integers(0, len(val_in), size=batch)]
+    nets = {"retrieval": net}
+    if model_path is not None:
+        import numpy_backend
+        npz_path = os.path.splitext(model_path)[0] + ".npz"
+        if not os.path.exists(npz_path):
+            numpy_backend.export_npz(model_path, npz_path)
+        nets["mlp"] = numpy_backend.NumpyTrajNet(npz_path)
+
+    result = {"build_s": build_s, "build_peak_mb": build_peak / 2 ** 20,
+              "index_mb": net.memory_bytes() / 2 ** 20}
+    lat = np.empty(single_calls)
+    for name, model in nets.items():
+        model.predict_batch(queries[:1024])
+        for i, (dx, dy) in enumerate(queries[:single_calls]):
+            t = time.perf_counter()
+            model.predict(dx, dy)
+            lat[i] = (time.perf_counter() - t) * 1e6
+        t = time.perf_counter()
+        model.predict_batch(queries)
+        per_s = batch / (time.perf_counter() - t)
+        err = np.linalg.norm(model.predict_batch(val_in) - val_tgt, axis=-1).mean()
+        result[name] = dict(_percentiles(lat), batch_per_s=per_s, val_error_px=float(err))
+    return result
+
+def bench_raw_archive(n, workdir, limit=100000):
+    # 完整解析度軌跡：二進位封存檔 vs 同內容的 JSONL 文字 (另附只存 10 點的現行格式大小)
+    n = min(n, limit)
+    points, offsets, moves = make_raw_trajectories(n)
+    points = points.astype(np.int32) + np.array([400, 300], dtype=np.int32)
+    times = np.arange(offsets[-1]) * 1e-3
+    raw = [(points[offsets[i]:offsets[i + 1]], times[offsets[i]:offsets[i + 1]]) for i in range(n)]
+    base = os.path.join(workdir, f"raw_{n}.jsonl")
+
+    start = time.perf_counter()
+    RawArchiveWriter(base, fsync=False).save(raw)
+    write_s = time.perf_counter() - start
+    archive = RawArchive(base)
+    archive_bytes = sum(os.path.getsize(p) for p in archive_paths(base))
+
+    json_path = os.path.join(workdir, f"raw_{n}.full.jsonl")
+    with open(json_path, "w", encoding="utf-8") as f:
+        for (pts, t), move in zip(raw, moves):
+            f.write(json.dumps({"relative_move": {"dx": int(move[0]), "dy": int(move[1])},
+                                "trajectory": (pts - pts[0]).tolist(),
+                                "t_us": np.rint((t - t[0]) * 1e6).astype(int).tolist()}) + "\n")
+    ten_bytes = sum(len(format_record(move, traj)) for move, traj in
+                    zip(moves, interpolate_batch(points, offsets, num=10)))
+
+    start = time.perf_counter()
+    decoded, _ = archive.load_all()
+    bulk_s = time.perf_counter() - start
+    m = min(n, 20000)
+    start = time.perf_counter()
+    for i in range(m):
+        archive.points(i)
+        archive.times_us(i)
+    view_s = time.perf_counter() - start
+    start = time.perf_counter()
+    archive.resample(10)
+    resample_s = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(json_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            np.asarray(record["trajectory"], dtype=np.int32)
+    json_s = time.perf_counter() - start
+    assert len(decoded) == offsets[-1]
+    return {"records": n, "points": int(offsets[-1]), "archive_mb": archive_bytes / 2 ** 20,
+            "full_jsonl_mb": os.path.getsize(json_path) / 2 ** 20, "jsonl10_mb": ten_bytes / 2 ** 20,
+            "write_s": write_s, "archive_bulk_points_per_s": offsets[-1] / bulk_s,
+            "archive_single_traj_per_s": m / view_s, "archive_resample_traj_per_s": n / resample_s,
+            "jsonl_points_per_s": offsets[-1] / json_s, "jsonl_traj_per_s": n / json_s}
+
+def _gc_collections():
+    return sum(stat["collections"] for stat in gc.get_stats())
+
+def bench_jitter(model_path, calls=20000, seed=0):
+    # 比較單筆推理的延遲分布：session.run (每次配置新陣列)、InferenceEngine、IO binding 寫入預先配置的陣列，
+    # 以及實際呼叫端走的 run_inference(out=...) (含取得引擎與檢查模型是否更新的成本)
+    import onnxruntime as ort
+    import test_model
+    moves = np.random.default_rng(seed).integers(-350, 351, size=(calls, 2)).astype(np.float32)
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    engine = test_model.InferenceEngine(model_path, pool_size=1)
+    bound = test_model.BoundInference(model_path, max_batch=1)
+    out = np.empty((10, 2), dtype=np.float32)
+
+    paths = {
+        "session_run": lambda dx, dy: session.run(None, {"input": np.array([[dx, dy]], dtype=np.float32)})[0].reshape(10, 2),
+        "engine": engine.predict,
+        "iobinding": lambda dx, dy: bound.predict(dx, dy, out),
+        "run_inference_out": lambda dx, dy: test_model.run_inference(model_path, dx, dy, out),
+    }
+    result = {}
+    lat = np.empty(calls)
+    for name, predict in paths.items():
+        for dx, dy in moves[:200]:
+            predict(dx, dy)
+        gc_before = _gc_collections()
+        for i, (dx, dy) in enumerate(moves):
+            t = time.perf_counter()
+            predict(dx, dy)
+            lat[i] = (time.perf_counter() - t) * 1e6
+        p50, p99, p999 = np.percentile(lat, [50, 99, 99.9])
+        result[name] = {"p50_us": p50, "p99_us": p99, "p999_us": p999, "max_us": lat.max(),
+                        "std_us": lat.std(), "gc_collections": _gc_collections() - gc_before}
+    engine.close()
+    return result
+
+# ===================== 整體流程 =====================
+def environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "numpy": np.__version__}
+    for name in ("torch", "onnxruntime"):
+        try:
+            info[name] = __import__(name).__version__
+        except ImportError:
+            info[name] = None
+    return info
+
+def run(sizes, epochs=1, batch_size=32, skip_train=False, workdir=None):
+    results = {"env": environment(), "sizes": {}}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        model_path = None
+        for n in sizes:
+            print(f"[{n}] generating synthetic dataset...")
+            path = write_synthetic_jsonl(os.path.join(tmp, f"bench_{n}.jsonl"), n)
+            entry = {"file_mb": os.path.getsize(path) / 2 ** 20}
+            print(f"[{n}] resample")
+            entry["resample"] = bench_resample(n)
+            print(f"[{n}] load")
+            entry["load"] = bench_load(path)
+            if not skip_train:
+                print(f"[{n}] train")
+                entry["train"], model_path = bench_train(path, tmp, epochs, batch_size)
+            print(f"[{n}] retrieval")
+            entry["retrieval"] = bench_retrieval(path, None if skip_train else model_path)
+            print(f"[{n}] raw archive")
+            entry["raw_archive"] = bench_raw_archive(n, tmp)
+            results["sizes"][str(n)] = entry
+        if model_path is not None:
+            print("inference")
+            results["inference"] = bench_inference(model_path)
+            print("jitter")
+            results["jitter"] = bench_jitter(model_path)
+    return results
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+def higher_is_better(key):
+    return key.endswith("per_s")
+
+def compare(old, new, threshold=0.10):
+    # 回傳 (key, old, new, 變化比例, 是否退步)，只比較兩邊都有的數值
+    a, b = flatten(old), flatten(new)
+    rows = []
+    for key in sorted(set(a) & set(b)):
+        if key.startswith("env.") or a[key] == 0:
+            continue
+        change = (b[key] - a[key]) / abs(a[key])
+        worse = -change if higher_is_better(key) else change
+        rows.append((key, a[key], b[key], change, worse > threshold))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark for the collect -> train -> infer pipeline")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--skip-train", action="store_true")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--jitter", metavar="MODEL", help="only run the single-call latency jitter benchmark on MODEL")
+    parser.add_argument("--normalization", metavar="DATASET",
+                        help="only compare epochs / time to a target val loss with and without normalization")
+    args = parser.parse_args(argv)
+
+    if args.normalization:
+        with tempfile.TemporaryDirectory() as tmp:
+            r = bench_normalization(args.normalization, tmp, max(args.epochs, 30), args.batch_size)
+        print(f"target val loss {r['target_val_loss']:.3f} (1.05x best raw-pixel val loss)")
+        for name in ("raw", "normalized"):
+            e = r[name]
+            to_target = (f"{e['epochs_to_target']} epochs / {e['seconds_to_target']:.1f}s"
+                         if e["epochs_to_target"] else "not reached")
+            print(f"{name:11s} best {e['best_val_loss']:8.3f}  final {e['final_val_loss']:8.3f}  target: {to_target}")
+        return 0
+
+    if args.jitter:
+        results = bench_jitter(args.jitter)
+        print(f"{'path':17s} {'p50 us':>8s} {'p99 us':>8s} {'p99.9 us':>9s} {'max us':>9s} {'std us':>8s} {'gc':>5s}")
+        for name, r in results.items():
+            print(f"{name:17s} {r['p50_us']:8.1f} {r['p99_us']:8.1f} {r['p999_us']:9.1f} {r['max_us']:9.1f} "
+                  f"{r['std_us']:8.2f} {r['gc_collections']:5d}")
+        return 0
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = 0
+        for key, a, b, change, regressed in compare(old, new, args.threshold):
+            flag = "REGRESSION" if regressed else ""
+            regressions += regressed
+            print(f"{key:55s} {a:14.4f} {b:14.4f} {change:+8.1%} {flag}")
+        print(f"{regressions} regression(s) over {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run(sizes, args.epochs, args.batch_size, args.skip_train)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved -> {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
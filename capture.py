@@ -0,0 +1,114 @@
+import time
+import numpy as np
+
+# 高頻游標取樣：MOUSEMOTION 事件逐一寫入預先配置的陣列，繪圖與取樣分開排程
+# SDL 會把兩次讀取之間的所有移動事件排進佇列，所以畫面慢不會丟點。每個事件各自一個時間戳 (event_times)：
+# pygame-ce 的事件帶 SDL 時間戳 (ms)，換算到 perf_counter；pygame 2.x 沒有提供，
+# 改為把同一次讀到的事件平均分布在上次與這次讀取之間，誤差上限為兩次讀取間的間隔 (stats 的 max gap)
+
+def event_times(events, start, end, ticks_ms):
+    # events: 一次讀取中的移動事件 (依序)；start / end: 上次與這次讀取的 perf_counter；ticks_ms: end 時的 SDL ticks
+    n = len(events)
+    if n == 0:
+        return []
+    if all(hasattr(e, "timestamp") for e in events):
+        times = [end - (ticks_ms - e.timestamp) / 1000.0 for e in events]
+    else:
+        step = (end - start) / n
+        times = [start + step * (k + 1) for k in range(n)]
+    # 兩種時基換算可能差 1 ms，確保不會倒退
+    for k in range(1, n):
+        if times[k] < times[k - 1]:
+            times[k] = times[k - 1]
+    return times
+
+class MotionBuffer:
+    # (x, y, t) 緩衝區，容量不足時倍增；points() / times() 回傳 view，不複製
+    def __init__(self, capacity=4096):
+        self.xy = np.empty((capacity, 2), dtype=np.int32)
+        self.t = np.empty(capacity, dtype=np.float64)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self):
+        capacity = len(self.t) * 2
+        xy = np.empty((capacity, 2), dtype=np.int32)
+        t = np.empty(capacity, dtype=np.float64)
+        xy[:self.n] = self.xy[:self.n]
+        t[:self.n] = self.t[:self.n]
+        self.xy, self.t = xy, t
+
+    def append(self, x, y, t):
+        if self.n == len(self.t):
+            self._grow()
+        self.xy[self.n, 0] = x
+        self.xy[self.n, 1] = y
+        self.t[self.n] = t
+        self.n += 1
+
+    def clear(self):
+        # 只重設長度，保留已配置的空間給下一筆軌跡
+        self.n = 0
+
+    def points(self):
+        return self.xy[:self.n]
+
+    def times(self):
+        return self.t[:self.n]
+
+class CaptureStats:
+    # 取樣率 (只算收集中的時間)、繪圖幀率、掉幀數、收集中離開事件佇列的最長時間
+    def __init__(self, frame_interval, window=1.0):
+        self.frame_interval = frame_interval
+        self.window = window
+        self.samples = 0
+        self.capture_s = 0.0
+        self.frames = 0
+        self.dropped = 0
+        self.max_gap = 0.0
+        self._last_poll = None
+        self._window_start = time.perf_counter()
+        self._window_samples = 0
+        self._window_frames = 0
+        self.rate = 0.0
+        self.fps = 0.0
+
+    def away(self, seconds, collecting):
+        # 迴圈離開事件佇列 (繪圖、處理事件) 的時間，期間進來的事件時間戳會延後
+        if collecting:
+            self.max_gap = max(self.max_gap, seconds)
+
+    def poll(self, now, n_samples, collecting, since):
+        # since: 本筆軌跡開始收集的時間，避免把按下前的空檔算進取樣時間
+        if self._last_poll is not None and collecting:
+            self.capture_s += now - max(self._last_poll, since)
+        self._last_poll = now
+        self.samples += n_samples
+        self._window_samples += n_samples
+
+    def frame(self, scheduled, end):
+        # 繪圖結束時已錯過的排程時段算作掉幀，回傳下一幀的排程時間 (錯過的時段不補畫)
+        self.frames += 1
+        self._window_frames += 1
+        missed = int((end - scheduled) // self.frame_interval)
+        self.dropped += missed
+        elapsed = end - self._window_start
+        if elapsed >= self.window:
+            self.rate = self._window_samples / elapsed
+            self.fps = self._window_frames / elapsed
+            self._window_start = end
+            self._window_samples = self._window_frames = 0
+        return scheduled + self.frame_interval * (missed + 1)
+
+    def mean_rate(self):
+        return self.samples / self.capture_s if self.capture_s > 0 else 0.0
+
+    def summary(self):
+        return {"samples": self.samples, "capture_s": self.capture_s, "samples_per_s": self.mean_rate(),
+                "frames": self.frames, "dropped_frames": self.dropped, "max_poll_gap_ms": self.max_gap * 1000}
+
+    def text(self):
+        return (f"{self.rate:.0f} samples/s  {self.fps:.0f} fps  dropped {self.dropped}  "
+                f"gap {self.max_gap * 1000:.1f} ms")
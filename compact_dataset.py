@@ -0,0 +1,219 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from dataset_cache import iter_line_chunks, parse_lines, is_shard_dir, SHARD_MANIFEST
+
+# 資料集整理：合併多次收集的 JSONL (可為 .gz)，平行驗證、去除壞行 / 退化 / 重複紀錄，
+# 輸出壓縮且帶 checksum 的分片目錄，train_model / load_arrays 可直接讀取
+#   python compact_dataset.py session1.jsonl session2.jsonl.gz -o mouse_compact --workers 8
+#   python train_model.py mouse_compact
+# 1. 每個檔案切成約 --range-mb 的位元組範圍 (gz 整檔一個)，各 worker 解析、驗證並把有效紀錄存成暫存 part
+#    同時回傳每筆的 64-bit 雜湊
+# 2. 主行程依輸入順序串接雜湊找出候選重複，雜湊相同的紀錄再從 part 讀回逐位元組比對，
+#    保留每種內容第一次出現的紀錄 (雜湊碰撞不會誤刪不同的紀錄)
+# 3. 各 worker 把 part 過濾後寫成 shard-NNNNN.npz (數值都是整數時存 int16)，並計算 blake2b
+
+MANIFEST_VERSION = 1
+RANGE_MB = 64
+_RECORD_SUFFIX = b"]]}"
+
+# ===================== 驗證 =====================
+def _parse_checked(lines):
+    # 回傳 (inputs, targets, malformed)；整塊格式正確時走 parse_lines 的快速路徑，否則逐行解析
+    lines = [line for line in lines if line.strip()]
+    if all(line.rstrip().endswith(_RECORD_SUFFIX) for line in lines):
+        try:
+            inputs, targets = parse_lines(lines)
+            return inputs, targets, 0
+        except (ValueError, KeyError, TypeError, IndexError):
+            pass
+    good_x, good_y, malformed = [], [], 0
+    for line in lines:
+        try:
+            x, y = parse_lines([line])
+        except (ValueError, KeyError, TypeError, IndexError):
+            malformed += 1
+            continue
+        good_x.append(x)
+        good_y.append(y)
+    if not good_x:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 20), dtype=np.float32), malformed
+    return np.concatenate(good_x), np.concatenate(good_y), malformed
+
+def degenerate_mask(inputs, targets):
+    # 軌跡總長度為 0 (所有點重合，interpolate_points 會輸出全 0) 或含 NaN / inf
+    finite = np.isfinite(inputs).all(axis=1) & np.isfinite(targets).all(axis=1)
+    pts = targets.reshape(-1, 10, 2)
+    moving = (pts[:, 1:] != pts[:, :1]).any(axis=(1, 2))
+    return ~(finite & moving)
+
+def _canonical(rows):
+    # +0.0 把 -0.0 統一成 0.0，讓數值相同的紀錄位元組也相同
+    return np.ascontiguousarray(rows + np.float32(0.0))
+
+def record_hashes(inputs, targets):
+    # 22 個 float32 視為 11 個 uint64 逐欄混合
+    rows = _canonical(np.concatenate([inputs, targets], axis=1))
+    words = rows.view(np.uint64)
+    h = np.full(len(rows), 0xCBF29CE484222325, dtype=np.uint64)
+    for col in words.T:
+        h ^= col
+        h *= np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(29)
+    return h
+
+# ===================== worker =====================
+def scan_range(path, start, end, part_path):
+    stats = {"lines": 0, "malformed": 0, "degenerate": 0, "valid": 0}
+    xs, ys = [], []
+    for lines in iter_line_chunks(path, start, end):
+        stats["lines"] += sum(1 for line in lines if line.strip())
+        x, y, malformed = _parse_checked(lines)
+        stats["malformed"] += malformed
+        bad = degenerate_mask(x, y)
+        stats["degenerate"] += int(bad.sum())
+        xs.append(x[~bad])
+        ys.append(y[~bad])
+    x = np.concatenate(xs) if xs else np.zeros((0, 2), dtype=np.float32)
+    y = np.concatenate(ys) if ys else np.zeros((0, 20), dtype=np.float32)
+    stats["valid"] = len(x)
+    np.save(part_path, np.concatenate([x, y], axis=1))
+    return stats, record_hashes(x, y)
+
+def write_shard(part_path, keep, shard_path):
+    rows = np.load(part_path)[keep]
+    os.remove(part_path)
+    if len(rows) == 0:
+        return None
+    # 收集時座標已四捨五入成整數，可無損存成 int16，壓縮後約為 float32 的一半以下
+    if np.array_equal(rows, np.rint(rows)) and np.abs(rows).max() <= 32767:
+        rows = rows.astype(np.int16)
+    np.savez_compressed(shard_path, inputs=rows[:, :2], targets=rows[:, 2:])
+    h = hashlib.blake2b(digest_size=16)
+    with open(shard_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return {"file": os.path.basename(shard_path), "count": len(rows), "dtype": str(rows.dtype),
+            "bytes": os.path.getsize(shard_path), "blake2b": h.hexdigest()}
+
+# ===================== 主流程 =====================
+def first_occurrences(hashes, parts, bounds):
+    # 回傳每種內容第一次出現的位置 (bool mask)；只有雜湊重複的紀錄需要讀回 part 比對內容
+    keep = np.zeros(len(hashes), dtype=bool)
+    _, first, inverse, counts = np.unique(hashes, return_index=True, return_inverse=True, return_counts=True)
+    keep[first[counts == 1]] = True
+    shared = np.flatnonzero(counts[inverse] > 1)
+    if len(shared) == 0:
+        return keep
+    owner = np.searchsorted(bounds, shared, side="right") - 1
+    rows = [np.load(parts[k], mmap_mode="r")[shared[owner == k] - bounds[k]] for k in np.unique(owner)]
+    rows = _canonical(np.concatenate(rows))
+    exact = rows.view(np.dtype((np.void, rows.shape[1] * rows.itemsize))).ravel()
+    # shared 依位置排序，np.unique 的 return_index 即每種內容最早的一筆
+    keep[shared[np.unique(exact, return_index=True)[1]]] = True
+    return keep
+
+def plan_ranges(paths, range_bytes):
+    tasks = []
+    for i, path in enumerate(paths):
+        if path.endswith(".gz"):
+            tasks.append((i, path, 0, None))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), range_bytes):
+            tasks.append((i, path, start, min(size, start + range_bytes)))
+    return tasks
+
+def check_out_dir(paths, out_dir):
+    # 輸出目錄會被整個取代：只允許不存在、空目錄或先前輸出的分片目錄，且不能包含任何輸入檔
+    out = os.path.realpath(out_dir)
+    for path in paths:
+        if os.path.commonpath([os.path.realpath(path), out]) == out:
+            raise ValueError(f"input {path} is inside the output directory {out_dir}")
+    if os.path.commonpath([os.getcwd(), out]) == out:
+        raise ValueError(f"output directory {out_dir} contains the working directory")
+    if os.path.exists(out_dir) and not is_shard_dir(out_dir) and not (os.path.isdir(out_dir) and not os.listdir(out_dir)):
+        raise ValueError(f"{out_dir} exists and is not an empty or shard directory, refusing to replace it")
+
+def compact(paths, out_dir, workers=None, range_mb=RANGE_MB, dedup=True):
+    check_out_dir(paths, out_dir)
+    workers = workers or os.cpu_count() or 1
+    tasks = plan_ranges(paths, range_mb << 20)
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    # 暫存目錄每次新建，不會動到使用者既有的同名目錄
+    parent, name = os.path.split(os.path.normpath(os.path.abspath(out_dir)))
+    tmp_dir = tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=parent)
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(workers) as pool:
+        parts = [os.path.join(tmp_dir, f"part-{k:05d}.npy") for k in range(len(tasks))]
+        scanned = list(pool.map(scan_range, [t[1] for t in tasks], [t[2] for t in tasks], [t[3] for t in tasks], parts))
+        scan_s = time.perf_counter() - start
+
+        # 依輸入順序 (檔案、位移) 保留第一次出現的內容
+        hashes = np.concatenate([h for _, h in scanned]) if scanned else np.zeros(0, dtype=np.uint64)
+        bounds = np.cumsum([0] + [len(h) for _, h in scanned])
+        keep = np.ones(len(hashes), dtype=bool)
+        if dedup and len(hashes):
+            keep = first_occurrences(hashes, parts, bounds)
+        keeps = [keep[bounds[k]:bounds[k + 1]] for k in range(len(tasks))]
+        shard_paths = [os.path.join(tmp_dir, f"shard-{k:05d}.npz") for k in range(len(tasks))]
+        shards = [s for s in pool.map(write_shard, parts, keeps, shard_paths) if s is not None]
+
+    sources = [{"path": os.path.abspath(p), "bytes": os.path.getsize(p), "lines": 0, "malformed": 0,
+                "degenerate": 0, "duplicates": 0, "kept": 0} for p in paths]
+    for (i, *_), (stats, _), k in zip(tasks, scanned, keeps):
+        src = sources[i]
+        for key in ("lines", "malformed", "degenerate"):
+            src[key] += stats[key]
+        src["kept"] += int(k.sum())
+        src["duplicates"] += stats["valid"] - int(k.sum())
+    elapsed = time.perf_counter() - start
+    manifest = {"version": MANIFEST_VERSION, "records": sum(s["count"] for s in shards), "shards": shards,
+                "sources": sources, "dedup": dedup, "workers": workers, "seconds": elapsed,
+                "input_mb_per_s": total_bytes / 2 ** 20 / max(elapsed, 1e-9), "scan_s": scan_s}
+    with open(os.path.join(tmp_dir, SHARD_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+def print_report(manifest):
+    print(f"{'file':40s} {'lines':>9s} {'malformed':>9s} {'degen':>7s} {'dupes':>8s} {'kept':>9s}")
+    for s in manifest["sources"]:
+        name = os.path.basename(s["path"])[-40:]
+        print(f"{name:40s} {s['lines']:9d} {s['malformed']:9d} {s['degenerate']:7d} {s['duplicates']:8d} {s['kept']:9d}")
+    size = sum(s["bytes"] for s in manifest["shards"]) / 2 ** 20
+    print(f"{manifest['records']} records in {len(manifest['shards'])} shards ({size:.1f} MB), "
+          f"{manifest['seconds']:.1f}s with {manifest['workers']} workers "
+          f"({manifest['input_mb_per_s']:.1f} MB/s of input)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate, dedup and compact JSONL datasets into checksummed shards")
+    parser.add_argument("inputs", nargs="+", help="JSONL files (.jsonl or .jsonl.gz), in priority order for dedup")
+    parser.add_argument("-o", "--out", default="mouse_compact", help="output shard directory")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--range-mb", type=int, default=RANGE_MB, help="bytes of input per task / output shard")
+    parser.add_argument("--no-dedup", action="store_true")
+    args = parser.parse_args(argv)
+    try:
+        manifest = compact(args.inputs, args.out, args.workers, args.range_mb, not args.no_dedup)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print_report(manifest)
+    print(f"Compacted dataset saved -> {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
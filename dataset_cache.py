@@ -0,0 +1,241 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import metrics
+
+# 將 mouse_dataset.jsonl 編譯成連續的 float32 陣列 (inputs: N×2, targets: N×20)
+# 以 .npy 存在 JSONL 旁邊，之後用 mmap 開啟，幾乎不佔記憶體也不需要重新 json.loads
+# 也接受 compact_dataset.py 輸出的壓縮分片目錄 (manifest.json + shard-*.npz)，讀取時逐片驗證 checksum
+
+CACHE_VERSION = 1
+CHUNK_ROWS = 65536
+SHARD_MANIFEST = "manifest.json"
+
+def cache_dir_for(jsonl_file):
+    return os.path.normpath(jsonl_file) + ".cache"
+
+def is_shard_dir(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, SHARD_MANIFEST))
+
+def source_file(path):
+    # 分片目錄以 manifest 代表整份資料：manifest 內含每片的 checksum，內容變了 manifest 一定跟著變
+    return os.path.join(path, SHARD_MANIFEST) if is_shard_dir(path) else path
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse_record(line):
+    record = json.loads(line)
+    move = record["relative_move"]
+    return (move["dx"], move["dy"]), record["trajectory"]
+
+_RECORD_PREFIX = b'{"relative_move": {"dx": '
+_RECORD_KEYS = (b'"relative_move"', b'"dx"', b'"dy"', b'"trajectory"')
+_PUNCTUATION = bytes.maketrans(b'{}[]:,', b'      ')
+
+def parse_lines(lines):
+    # 一次解析一整塊 bytes 行：save_json 寫出的格式固定為 dx, dy 後接 10 個點，
+    # 去掉 key 與標點後整塊 split 成數字再 reshape；格式不符時退回逐行 json.loads
+    # 每行後面接一個 ";" 分隔 token，確認每一行都剛好 22 個數字 (只比總數的話多一點與少一點的兩行會錯位)
+    lines = [line for line in lines if line.strip()]
+    n = len(lines)
+    if n == 0:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 20), dtype=np.float32)
+    if all(line.startswith(_RECORD_PREFIX) for line in lines):
+        text = b" ; ".join(lines) + b" ;"
+        for key in _RECORD_KEYS:
+            text = text.replace(key, b"")
+        tokens = text.translate(_PUNCTUATION).split()
+        if len(tokens) == n * 23 and tokens[22::23].count(b";") == n:
+            del tokens[22::23]
+            try:
+                values = np.array(tokens, dtype=np.float32).reshape(n, 22)
+                return values[:, :2].copy(), values[:, 2:].copy()
+            except ValueError:
+                pass
+
+    inputs = np.empty((n, 2), dtype=np.float32)
+    targets = np.empty((n, 20), dtype=np.float32)
+    for i, line in enumerate(lines):
+        (dx, dy), traj = parse_record(line)
+        inputs[i] = (dx, dy)
+        targets[i] = np.asarray(traj, dtype=np.float32).reshape(20)
+    return inputs, targets
+
+def open_jsonl(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def iter_line_chunks(path, start=0, end=None, chunk_lines=CHUNK_ROWS):
+    # 讀取 [start, end) 位元組範圍內「開頭」落在其中的每一行，按 chunk_lines 分塊回傳
+    # gzip 檔無法 seek 到任意位置，只支援整檔讀取
+    with open_jsonl(path) as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        chunk = []
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            chunk.append(line)
+            if len(chunk) == chunk_lines:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def parse_jsonl(jsonl_file, start=0, end=None):
+    # 可只解析 [start, end) 位元組範圍，增量訓練用來讀取上次之後新增的紀錄
+    in_chunks, tgt_chunks = [], []
+    for lines in iter_line_chunks(jsonl_file, start, end):
+        with metrics.timer("dataset.parse_chunk"):
+            inputs, targets = parse_lines(lines)
+        metrics.count("dataset.records", len(inputs))
+        in_chunks.append(inputs)
+        tgt_chunks.append(targets)
+    if not in_chunks:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 20), dtype=np.float32)
+    return np.concatenate(in_chunks), np.concatenate(tgt_chunks)
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, SHARD_MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def shard_files(shard_dir):
+    # [(路徑, checksum), ...]，依 manifest 順序
+    return [(os.path.join(shard_dir, s["file"]), s["blake2b"]) for s in read_manifest(shard_dir)["shards"]]
+
+def load_shard(path, checksum=None):
+    with open(path, "rb") as f:
+        data = f.read()
+    if checksum is not None and hashlib.blake2b(data, digest_size=16).hexdigest() != checksum:
+        raise ValueError(f"Checksum mismatch in {path}, the shard is corrupted")
+    with np.load(io.BytesIO(data)) as z:
+        return z["inputs"].astype(np.float32), z["targets"].astype(np.float32)
+
+def parse_shards(shard_dir):
+    in_chunks, tgt_chunks = [], []
+    for path, checksum in shard_files(shard_dir):
+        with metrics.timer("dataset.load_shard"):
+            inputs, targets = load_shard(path, checksum)
+        in_chunks.append(inputs)
+        tgt_chunks.append(targets)
+    if not in_chunks:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 20), dtype=np.float32)
+    return np.concatenate(in_chunks), np.concatenate(tgt_chunks)
+
+def complete_size(path):
+    # 最後一個完整行 (以換行結尾) 的結束位移；寫到一半的最後一行不算
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                return pos - step + i + 1
+            pos -= step
+    return 0
+
+def tail_digest(path, offset, length=4096):
+    # offset 之前最後 length 個位元組的雜湊，用來確認檔案在 offset 之前沒有被改寫
+    start = max(0, offset - length)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(offset - start)
+    if len(data) != offset - start:
+        return None
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def split_indices(n, val_frac=0.1, seed=0):
+    # 固定種子的 train / validation 切分，訓練與評估共用同一份驗證集
+    perm = np.random.default_rng(seed).permutation(n)
+    n_val = int(round(n * val_frac)) if n > 1 else 0
+    return np.sort(perm[n_val:]), np.sort(perm[:n_val])
+
+def kfold_indices(n, k, fold, seed=0):
+    # 第 fold 折 (0 起算) 的 (train_idx, val_idx)，各折互不重疊且合起來涵蓋全部資料
+    folds = np.array_split(np.random.default_rng(seed).permutation(n), k)
+    val = np.sort(folds[fold])
+    train = np.sort(np.concatenate([f for i, f in enumerate(folds) if i != fold]))
+    return train, val
+
+def _source_key(jsonl_file):
+    st = os.stat(source_file(jsonl_file))
+    return {"version": CACHE_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(cache_dir, meta):
+    tmp = os.path.join(cache_dir, "meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(cache_dir, "meta.json"))
+
+def dataset_digest(jsonl_file):
+    # 資料內容的雜湊；檔案大小與 mtime 和 .npy 快取建立時相同就沿用 meta 裡的值，不必重讀整個檔案
+    meta = _read_meta(cache_dir_for(jsonl_file))
+    key = _source_key(jsonl_file)
+    if meta and meta.get("hash") and meta.get("size") == key["size"] and meta.get("mtime_ns") == key["mtime_ns"]:
+        return meta["hash"]
+    return file_digest(source_file(jsonl_file))
+
+def build_cache(jsonl_file, cache_dir=None):
+    cache_dir = cache_dir or cache_dir_for(jsonl_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _source_key(jsonl_file)
+    digest = file_digest(source_file(jsonl_file))
+    with metrics.timer("dataset.build_cache"):
+        inputs, targets = parse_shards(jsonl_file) if is_shard_dir(jsonl_file) else parse_jsonl(jsonl_file)
+
+    for name, arr in (("inputs", inputs), ("targets", targets)):
+        tmp = os.path.join(cache_dir, name + ".tmp.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, os.path.join(cache_dir, name + ".npy"))
+    _write_meta(cache_dir, dict(key, hash=digest, count=len(inputs)))
+    print(f"Dataset cache built: {len(inputs)} samples -> {cache_dir}")
+
+def is_cache_valid(jsonl_file, cache_dir=None):
+    cache_dir = cache_dir or cache_dir_for(jsonl_file)
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get("version") != CACHE_VERSION:
+        return False
+    if not all(os.path.exists(os.path.join(cache_dir, n + ".npy")) for n in ("inputs", "targets")):
+        return False
+    key = _source_key(jsonl_file)
+    if meta["size"] == key["size"] and meta["mtime_ns"] == key["mtime_ns"]:
+        return True
+    # 只被 touch 過 (mtime 變了但內容相同) 時不需要重建，更新 meta 即可
+    if meta["size"] == key["size"] and meta.get("hash") == file_digest(source_file(jsonl_file)):
+        _write_meta(cache_dir, dict(meta, mtime_ns=key["mtime_ns"]))
+        return True
+    return False
+
+def load_arrays(jsonl_file, use_cache=True, mmap=True):
+    if not use_cache:
+        return parse_shards(jsonl_file) if is_shard_dir(jsonl_file) else parse_jsonl(jsonl_file)
+    cache_dir = cache_dir_for(jsonl_file)
+    if not is_cache_valid(jsonl_file, cache_dir):
+        build_cache(jsonl_file, cache_dir)
+    mode = "r" if mmap else None
+    inputs = np.load(os.path.join(cache_dir, "inputs.npy"), mmap_mode=mode)
+    targets = np.load(os.path.join(cache_dir, "targets.npy"), mmap_mode=mode)
+    return inputs, targets
@@ -0,0 +1,109 @@
+import json
+import os
+import zlib
+
+# 以「本次收集開始時的檔案位移」取代 truncate_last_lines：
+# 每次按 S 只需 truncate 回第一筆有變動的紀錄並 append 後面的資料，成本只與本次收集的筆數有關
+# 另外在 <filename>.journal 記錄寫入前的長度 (以 rename 原子更新)，寫到一半當機時下次開啟會自動回復
+
+def format_record(dx_dy, traj_rel):
+    dx, dy = dx_dy
+    record = {
+        "relative_move": {"dx": int(round(dx)), "dy": int(round(dy))},
+        "trajectory": [[int(round(x)), int(round(y))] for x, y in traj_rel]
+    }
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+class SessionWriter:
+    def __init__(self, filename="mouse_dataset.jsonl", fsync=True, atomic=False):
+        # atomic=True 時改為複製到暫存檔再 rename，任何時間點檔案都是完整的，但成本與檔案大小成正比
+        self.filename = filename
+        self.fsync = fsync
+        self.atomic = atomic
+        self.journal = filename + ".journal"
+        self.recover()
+        self.session_start = os.path.getsize(filename) if os.path.exists(filename) else 0
+        self.lines = []     # 已寫入檔案的紀錄 (bytes)
+        self.ends = []      # 每筆紀錄結束時的檔案位移
+
+    def _write_journal(self, pending, committed):
+        tmp = self.journal + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pending": pending, "committed": committed}, f)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.journal)
+
+    def recover(self):
+        try:
+            with open(self.journal, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("pending") and os.path.exists(self.filename):
+            committed = state["committed"]
+            if os.path.getsize(self.filename) > committed:
+                os.truncate(self.filename, committed)
+                print(f"Recovered {self.filename}: rolled back interrupted save to {committed} bytes")
+        self._write_journal(False, os.path.getsize(self.filename) if os.path.exists(self.filename) else 0)
+
+    def save(self, dataset):
+        lines = [format_record(dx_dy, traj_rel) for dx_dy, traj_rel in dataset]
+        keep = 0
+        while keep < min(len(lines), len(self.lines)) and lines[keep] == self.lines[keep]:
+            keep += 1
+        offset = self.ends[keep - 1] if keep else self.session_start
+
+        if keep == len(lines) == len(self.lines):
+            return 0
+
+        if self.atomic:
+            pos, ends = self._save_atomic(offset, keep, lines)
+        else:
+            pos, ends = self._save_inplace(offset, keep, lines)
+
+        self.lines = lines
+        self.ends = ends
+        return len(lines) - keep
+
+    def record_links(self):
+        # 本次收集已寫入的每筆紀錄在檔案中的 (起始位移, CRC32)，原始軌跡封存檔以此對應到 JSONL 的行
+        starts = [self.session_start] + self.ends[:-1]
+        return [(start, zlib.crc32(line)) for start, line in zip(starts, self.lines)]
+
+    def _append(self, f, offset, keep, lines):
+        ends = self.ends[:keep]
+        pos = offset
+        for line in lines[keep:]:
+            f.write(line)
+            pos += len(line)
+            ends.append(pos)
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        return pos, ends
+
+    def _save_inplace(self, offset, keep, lines):
+        self._write_journal(True, offset)
+        with open(self.filename, "ab") as f:
+            f.truncate(offset)
+            pos, ends = self._append(f, offset, keep, lines)
+        self._write_journal(False, pos)
+        return pos, ends
+
+    def _save_atomic(self, offset, keep, lines):
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as out:
+            if os.path.exists(self.filename):
+                with open(self.filename, "rb") as src:
+                    remaining = offset
+                    while remaining > 0:
+                        chunk = src.read(min(remaining, 1 << 20))
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            pos, ends = self._append(out, offset, keep, lines)
+        os.replace(tmp, self.filename)
+        return pos, ends
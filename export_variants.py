@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import onnxruntime as ort
+
+from dataset_cache import load_arrays, split_indices
+from prediction_cache import model_hash
+import metrics
+
+# 從 fp32 的 mouse_traj.onnx 產生其他版本並比較精度與速度：
+#   <name>.opt.onnx  : onnxruntime 離線最佳化後的圖 (Gemm + Relu 融合成 FusedGemm)
+#   <name>.int8.onnx : 動態量化的 INT8 權重
+# 報告存成 <name>.variants.json，pick_variant() 依誤差上限挑出最快的版本；
+# test_model 的引擎與 predict_cli 透過 recommended_path() 載入該版本 (報告對應的 fp32 模型雜湊相符時)
+
+VARIANTS = ("fp32", "optimized", "int8")
+
+def variant_paths(model_path):
+    base = os.path.splitext(model_path)[0]
+    return {"fp32": model_path, "optimized": base + ".opt.onnx", "int8": base + ".int8.onnx"}
+
+def _self_contained_copy(src, tmp):
+    # 新版 torch 會把權重存到 <name>.onnx.data；複製成權重內嵌的單一檔案，
+    # 產生的版本才不會指向 fp32 模型的外部資料。value_info 可能與權重形狀不一致，
+    # 會讓量化前的 shape inference 失敗，一併清掉
+    import onnx
+    model = onnx.load(src)
+    del model.graph.value_info[:]
+    path = os.path.join(tmp, "fp32.onnx")
+    onnx.save(model, path)
+    return path
+
+def export_optimized(src, dst):
+    # EXTENDED 只做與硬體無關的融合，存下來的圖可以在其他機器上使用
+    with tempfile.TemporaryDirectory() as tmp:
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        opts.optimized_model_filepath = dst
+        ort.InferenceSession(_self_contained_copy(src, tmp), opts, providers=["CPUExecutionProvider"])
+    return dst
+
+def export_int8(src, dst):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    with tempfile.TemporaryDirectory() as tmp:
+        quantize_dynamic(_self_contained_copy(src, tmp), dst, weight_type=QuantType.QInt8)
+    return dst
+
+def model_size_kb(path):
+    # 含外部權重檔的總大小
+    import onnx
+    model = onnx.load(path, load_external_data=False)
+    files = {os.path.join(os.path.dirname(path), e.value) for i in model.graph.initializer
+             for e in i.external_data if e.key == "location"}
+    return (os.path.getsize(path) + sum(os.path.getsize(f) for f in files if os.path.exists(f))) / 1024
+
+def _session(path, threads=1):
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = threads
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+def measure_latency(path, single_calls=2000, batch=4096, seed=0):
+    session = _session(path)
+    rng = np.random.default_rng(seed)
+    singles = rng.uniform(-400, 400, size=(single_calls, 1, 2)).astype(np.float32)
+    session.run(None, {"input": singles[0]})
+    lat = np.empty(single_calls)
+    for i, x in enumerate(singles):
+        t = time.perf_counter()
+        session.run(None, {"input": x})
+        lat[i] = (time.perf_counter() - t) * 1e6
+    moves = rng.uniform(-400, 400, size=(batch, 2)).astype(np.float32)
+    session.run(None, {"input": moves})
+    t = time.perf_counter()
+    session.run(None, {"input": moves})
+    batch_per_s = batch / (time.perf_counter() - t)
+    p50, p99 = np.percentile(lat, [50, 99])
+    return {"single_p50_us": float(p50), "single_p99_us": float(p99), "batch_per_s": float(batch_per_s)}
+
+def point_errors(pred, ref):
+    # 每個軌跡點的歐氏距離 (px)
+    return np.linalg.norm(pred.reshape(-1, 10, 2) - ref.reshape(-1, 10, 2), axis=-1)
+
+def evaluate(path, inputs, fp32_out, targets=None):
+    out = _session(path, threads=0).run(None, {"input": inputs})[0]
+    err = point_errors(out, fp32_out)
+    result = {"vs_fp32_mean_px": float(err.mean()), "vs_fp32_p95_px": float(np.percentile(err, 95)),
+              "vs_fp32_max_px": float(err.max())}
+    if targets is not None:
+        result["vs_target_mean_px"] = float(point_errors(out, targets).mean())
+    return result
+
+def eval_set(jsonl_file=None, val_frac=0.1, n_random=10000, seed=0):
+    # 有資料集時用固定種子切出的驗證集，否則用均勻分布的隨機位移 (沒有 ground truth)
+    if jsonl_file is not None and isinstance(jsonl_file, str) and os.path.exists(jsonl_file):
+        inputs, targets = load_arrays(jsonl_file)
+        if len(inputs):
+            _, val_idx = split_indices(len(inputs), val_frac, seed)
+            return np.asarray(inputs[val_idx], dtype=np.float32), np.asarray(targets[val_idx], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-400, 400, size=(n_random, 2)).astype(np.float32), None
+
+def pick_variant(report, error_budget_px=1.0):
+    # 在 p95 誤差不超過上限的版本中挑單筆延遲最低的
+    ok = [name for name, v in report["variants"].items() if v["vs_fp32_p95_px"] <= error_budget_px]
+    return min(ok, key=lambda name: report["variants"][name]["single_p50_us"]) if ok else "fp32"
+
+def recommended_path(model_path="mouse_traj.onnx"):
+    # 報告推薦的版本；沒有報告、報告屬於別的 fp32 模型 (例如這次訓練沒產生版本) 或檔案不存在時用原本的模型
+    try:
+        with open(os.path.splitext(model_path)[0] + ".variants.json", "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return model_path
+    name = report.get("recommended", "fp32")
+    if name == "fp32" or name not in report.get("variants", {}) or report.get("model_hash") != model_hash(model_path):
+        return model_path
+    # 報告中的路徑是產生時的相對位置，模型被複製到別處 (例如模型快取) 時以模型所在目錄為準
+    path = os.path.join(os.path.dirname(model_path), os.path.basename(report["variants"][name]["path"]))
+    return path if os.path.exists(path) else model_path
+
+def export_variants(model_path="mouse_traj.onnx", jsonl_file=None, error_budget_px=1.0):
+    paths = variant_paths(model_path)
+    with metrics.timer("export.optimized"):
+        export_optimized(model_path, paths["optimized"])
+    with metrics.timer("export.int8"):
+        export_int8(model_path, paths["int8"])
+
+    inputs, targets = eval_set(jsonl_file)
+    fp32_out = _session(model_path, threads=0).run(None, {"input": inputs})[0]
+    report = {"model": model_path, "model_hash": model_hash(model_path), "eval_samples": int(len(inputs)),
+              "error_budget_px": error_budget_px, "variants": {}}
+    for name in VARIANTS:
+        entry = {"path": paths[name], "size_kb": model_size_kb(paths[name])}
+        entry.update(evaluate(paths[name], inputs, fp32_out, targets))
+        entry.update(measure_latency(paths[name]))
+        report["variants"][name] = entry
+    report["recommended"] = pick_variant(report, error_budget_px)
+
+    report_path = os.path.splitext(model_path)[0] + ".variants.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"Variant report saved -> {report_path}")
+    return report
+
+def print_report(report):
+    print(f"{'variant':10s} {'size KB':>8s} {'err mean':>9s} {'err p95':>8s} {'p50 us':>8s} {'batch/s':>10s}")
+    for name, v in report["variants"].items():
+        print(f"{name:10s} {v['size_kb']:8.1f} {v['vs_fp32_mean_px']:9.3f} {v['vs_fp32_p95_px']:8.3f} "
+              f"{v['single_p50_us']:8.1f} {v['batch_per_s']:10.0f}")
+    print(f"Recommended (p95 error <= {report['error_budget_px']} px): {report['recommended']}")
+
+if __name__ == "__main__":
+    export_variants("mouse_traj.onnx", "mouse_dataset.jsonl")
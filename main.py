@@ -1,15 +1,36 @@
 import os
+import time
+_START_TIME = time.perf_counter()
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+import importlib
+
+# 啟動報告用的 import 時間；pygame 載入時會順便載入 numpy (若有安裝)，先單獨載入 numpy 才能分開計時
+IMPORT_TIMES = {}
+for _name in ("numpy", "pygame"):
+    _start = time.perf_counter()
+    try:
+        importlib.import_module(_name)
+    except ImportError:
+        continue
+    IMPORT_TIMES[_name] = time.perf_counter() - _start
 
 import pygame
 import sys
-import numpy as np
-import winsound
+try:
+    import winsound
+except ImportError:  # 非 Windows 平台沒有 winsound，提示音改為不發聲
+    winsound = None
 import io
-import contextlib
-import Trajectory
-import train_model
-import test_model
+import threading
+import collections
+import itertools
+import bisect
+import math
+import metrics
+
+# Trajectory / train_model (torch) / test_model (onnxruntime) 都很重，按下對應按鈕時才載入
+WARM_UP = True  # 主選單畫出後在背景執行緒預先載入
+WARM_UP_MODULES = ("Trajectory", "test_model")  # 訓練在子行程執行，GUI 不需要載入 torch
 
 # ===================== 英文領域高手 =====================
 current_lang = "zh"
@@ -23,8 +44,22 @@ LANG_TEXTS = {
         "log": "查看日誌",
         "quit": "退出",
         "lang": "English",
-        "test_title": "測試模型 (ESC 返回)",
-        "log_title": "日誌面板 (ESC 返回)"
+        "test_title": "測試模型 (ESC 返回, ←/→ 切換快取的模型版本)",
+        "log_title": "日誌面板 (ESC 返回)",
+        "cancel_train": "取消訓練",
+        "training": "訓練中",
+        "exporting": "匯出 ONNX 中...",
+        "variants": "產生最佳化 / INT8 版本...",
+        "grid": "建立預測網格...",
+        "cached": "資料與設定沒有變，還原快取的模型",
+        "model_current": "目前的模型",
+        "model_version": "快取版本",
+        "train_done": "訓練完成，模型已匯出",
+        "train_cancelled": "訓練已取消",
+        "train_failed": "訓練失敗，請查看日誌",
+        "metrics": "效能監控",
+        "metrics_title": "效能監控 (ESC 返回, E 開/關, D 匯出, R 重設)",
+        "metrics_off": "監控已關閉，按 E 開啟 (或設定環境變數 MTN_METRICS=1)"
     },
     "en": {
         "menu_title": "Main Menu",
@@ -34,8 +69,22 @@ LANG_TEXTS = {
         "log": "View Logs",
         "quit": "Quit",
         "lang": "中文",
-        "test_title": "Test Model (ESC to return)",
-        "log_title": "Log Panel (ESC to return)"
+        "test_title": "Test Model (ESC to return, Left/Right to switch cached versions)",
+        "log_title": "Log Panel (ESC to return)",
+        "cancel_train": "Cancel Training",
+        "training": "Training",
+        "exporting": "Exporting ONNX...",
+        "variants": "Building optimized / INT8 variants...",
+        "grid": "Building prediction grid...",
+        "cached": "Data and settings unchanged, restoring cached model",
+        "model_current": "Current model",
+        "model_version": "Cached version",
+        "train_done": "Training done, model exported",
+        "train_cancelled": "Training cancelled",
+        "train_failed": "Training failed, see logs",
+        "metrics": "Metrics",
+        "metrics_title": "Metrics (ESC return, E toggle, D dump, R reset)",
+        "metrics_off": "Metrics are off, press E to enable (or set MTN_METRICS=1)"
     }
 }
 
@@ -57,12 +106,17 @@ BTN_COLORS = {
     "train":   (39, 174, 96),
     "test":    (192, 57, 43),
     "log":     (155, 89, 182),
+    "metrics": (52, 73, 94),
     "quit":    (127, 140, 141)
 }
 BTN_HOVER_OFFSET = 30
 INPUT_BG = (60, 60, 80)
 INPUT_ACTIVE = (100, 100, 140)
 
+def beep(freq, duration):
+    if winsound is not None:
+        winsound.Beep(freq, duration)
+
 def load_cjk_font(size=20):
     candidates_path = [
         "SourceHanSansTC-Heavy.otf",            
@@ -83,18 +137,34 @@ FONT = load_cjk_font(22)
 FONT_SMALL = load_cjk_font(18)
 
 # 日誌攔截
+LOG_CAPACITY = 5000  # 只保留最近的行數，舊的自動丟棄
+
 class LogBuffer(io.StringIO):
-    def __init__(self):
+    def __init__(self, capacity=LOG_CAPACITY):
         super().__init__()
-        self.lines = []
+        self.lines = collections.deque(maxlen=capacity)
+        self.total = 0  # 累計寫入的行數，用來當作每行的編號
+        self.lock = threading.Lock()
 
     def write(self, text):
         sys.__stdout__.write(text)
-        for line in text.splitlines():
-            if line.strip():
-                self.lines.append(line)
+        with self.lock:
+            for line in text.splitlines():
+                if line.strip():
+                    self.lines.append(line)
+                    self.total += 1
         return len(text)
 
+    def oldest_id(self):
+        return self.total - len(self.lines)
+
+    def since(self, line_id):
+        # 回傳 (第一行的編號, 編號 >= line_id 且仍在 buffer 中的行)
+        with self.lock:
+            oldest = self.total - len(self.lines)
+            start = max(line_id, oldest)
+            return start, list(itertools.islice(self.lines, start - oldest, None))
+
     def flush(self):
         sys.__stdout__.flush()
 
@@ -102,6 +172,34 @@ log_buffer = LogBuffer()
 sys.stdout = log_buffer
 sys.stderr = log_buffer
 
+def lazy_import(name):
+    already_loaded = name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if not already_loaded:
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - start)
+    return module
+
+def warm_up(names=WARM_UP_MODULES):
+    def worker():
+        start = time.perf_counter()
+        for name in names:
+            try:
+                lazy_import(name)
+            except Exception as e:
+                print(f"Warm-up failed for {name}: {e}")
+        print(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+        print_startup_report()
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    return thread
+
+def print_startup_report(first_frame=None):
+    if first_frame is not None:
+        print(f"Startup: menu first frame after {first_frame:.3f}s")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda kv: -kv[1]):
+        print(f"  import {name}: {seconds:.3f}s")
+
 def adjust_color(color, offset):
     r = max(0, min(255, color[0] + offset))
     g = max(0, min(255, color[1] + offset))
@@ -136,27 +234,77 @@ class Button:
         return self.rect.collidepoint(pos)
 
 # ===================== 日誌面板 =====================
+_glyph_ok = {}
+
 def safe_render(text, font, color):
-    filtered = "".join(ch for ch in text if font.metrics(ch)[0] is not None)
-    return font.render(filtered, True, color)
-
-def draw_logs(surface, logs, scroll_offset):
-    y = 20 - scroll_offset
-    max_width = surface.get_width() - 40
-    line_height = FONT_SMALL.get_linesize()
-
-    for line in logs:
-        while FONT_SMALL.size(line)[0] > max_width:
-            cut = len(line)
-            while FONT_SMALL.size(line[:cut])[0] > max_width and cut > 0:
-                cut -= 1
-            txt = safe_render(line[:cut], FONT_SMALL, WHITE)
-            surface.blit(txt, (20, y))
-            y += line_height
-            line = line[cut:]
-        txt = safe_render(line, FONT_SMALL, WHITE)
-        surface.blit(txt, (20, y))
-        y += line_height
+    supported = _glyph_ok.setdefault(font, {})
+    chars = []
+    for ch in text:
+        ok = supported.get(ch)
+        if ok is None:
+            ok = supported[ch] = font.metrics(ch)[0] is not None
+        if ok:
+            chars.append(ch)
+    return font.render("".join(chars), True, color)
+
+def wrap_line(line, font, max_width):
+    # 以二分搜尋找出每段能放下的最長前綴
+    pieces = []
+    while font.size(line)[0] > max_width:
+        lo, hi = 1, len(line)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if font.size(line[:mid])[0] <= max_width:
+                lo = mid
+            else:
+                hi = mid - 1
+        pieces.append(line[:lo])
+        line = line[lo:]
+    pieces.append(line)
+    return pieces
+
+class LogView:
+    # 快取已換行、已繪製的每一列，只在有新日誌或寬度改變時更新，繪製時只 blit 可見範圍
+    def __init__(self, font=None, color=WHITE):
+        self.font = font or FONT_SMALL
+        self.color = color
+        self.width = None
+        self.rows = []      # 每一列的 Surface
+        self.row_ids = []   # 每一列所屬日誌行的編號
+        self.next_id = 0
+
+    def update(self, buffer, width):
+        if width != self.width:
+            self.width = width
+            self.rows, self.row_ids = [], []
+            self.next_id = 0
+        first_id, new_lines = buffer.since(self.next_id)
+        for i, line in enumerate(new_lines):
+            for piece in wrap_line(line, self.font, width):
+                self.rows.append(safe_render(piece, self.font, self.color))
+                self.row_ids.append(first_id + i)
+        self.next_id = first_id + len(new_lines)
+
+        oldest = buffer.oldest_id()
+        if self.row_ids and self.row_ids[0] < oldest:
+            k = bisect.bisect_left(self.row_ids, oldest)
+            del self.rows[:k]
+            del self.row_ids[:k]
+
+    def draw(self, surface, scroll_offset):
+        line_height = self.font.get_linesize()
+        top = 20 - scroll_offset
+        first = max(0, -top // line_height)
+        last = min(len(self.rows), (surface.get_height() - top) // line_height + 1)
+        for i in range(first, last):
+            surface.blit(self.rows[i], (20, top + i * line_height))
+
+def draw_logs(surface, view, scroll_offset):
+    view.update(log_buffer, surface.get_width() - 40)
+    view.draw(surface, scroll_offset)
+    return len(view.rows)
+
+log_view = LogView()
 
 def draw_scrollbar(surface, total_lines, scroll_offset):
     visible_height = HEIGHT - 150
@@ -170,27 +318,88 @@ def draw_scrollbar(surface, total_lines, scroll_offset):
     return rect
 
 # ===================== 測試模型 =====================
-def test_model_main(dx=100, dy=50):
-    if not os.path.exists("mouse_traj.onnx"):
+def test_model_main(dx=100, dy=50, model_path="mouse_traj.onnx"):
+    if not os.path.exists(model_path):
         return None
-    traj = test_model.run_inference("mouse_traj.onnx", dx, dy)
+    traj = lazy_import("test_model").run_inference(model_path, dx, dy)
     return traj
 
+def release_model(model_path):
+    if "test_model" in sys.modules:
+        sys.modules["test_model"].release(model_path)
+
+# ===================== 背景訓練 =====================
+training_job = None
+train_notice = None  # (文字 key, 顯示到何時)
+NOTICE_SECONDS = 5
+PROGRESS_COLOR = (39, 174, 96)
+
+def start_training():
+    global training_job, train_notice
+    # 有 checkpoint 時只用新收集的紀錄微調，資料被改寫過或沒有 checkpoint 時自動改為完整訓練
+    training_job = lazy_import("training_job").TrainingJob("mouse_dataset.jsonl", incremental=True)
+    train_notice = None
+
+def update_training():
+    # 每個畫面呼叫一次：把子行程的輸出寫進日誌，結束時留下提示訊息
+    global training_job, train_notice
+    if training_job is None:
+        return
+    for line in training_job.poll():
+        print(line)
+    # 同一個行程訓練 (use_process=False) 時 train_model 已經記錄過，只有子行程的要在這裡補記
+    if training_job.use_process:
+        for epoch in training_job.new_epochs:
+            metrics.record("train.epoch", epoch["epoch_s"])
+    if not training_job.running:
+        kind = training_job.result["type"]
+        if kind == "done":
+            print(f"Training finished: {training_job.result['path']}")
+        key = {"done": "train_done", "cancelled": "train_cancelled"}.get(kind, "train_failed")
+        train_notice = (key, time.perf_counter() + NOTICE_SECONDS)
+        training_job = None
+
+def draw_training_status(surface):
+    x, y, w = 320, 100, WIDTH - 370
+    texts = LANG_TEXTS[current_lang]
+    if training_job is not None:
+        info = training_job.last_epoch
+        if training_job.stage in ("export", "variants", "grid", "cached"):
+            line = texts["exporting" if training_job.stage == "export" else training_job.stage]
+            ratio = 1.0
+        elif info:
+            val = f"  val={info['val_loss']:.4f}" if info.get("val_loss") is not None else ""
+            line = (f"{texts['training']} {info['epoch']}/{info['epochs']}  loss={info['loss']:.4f}{val}  "
+                    f"{info['samples_per_s']:.0f} samples/s  ETA {info['eta']:.0f}s")
+            ratio = info["epoch"] / info["epochs"]
+        else:
+            line = texts["training"] + "..."
+            ratio = 0.0
+        surface.blit(FONT_SMALL.render(line, True, WHITE), (x, y))
+        pygame.draw.rect(surface, INPUT_BG, (x, y + 30, w, 16), border_radius=6)
+        pygame.draw.rect(surface, PROGRESS_COLOR, (x, y + 30, int(w * ratio), 16), border_radius=6)
+    elif train_notice is not None and time.perf_counter() < train_notice[1]:
+        surface.blit(FONT_SMALL.render(texts[train_notice[0]], True, WHITE), (x, y))
+
 # ===================== 主選單 =====================
 def main_menu():
     global current_lang
     clock = pygame.time.Clock()
     buttons = [
         Button(lambda: LANG_TEXTS[current_lang]["collect"], 50, 100, 180, 50, BTN_COLORS["collect"], "collect"),
-        Button(lambda: LANG_TEXTS[current_lang]["train"],   50, 180, 180, 50, BTN_COLORS["train"], "train"),
+        Button(lambda: LANG_TEXTS[current_lang]["cancel_train" if training_job else "train"],
+               50, 180, 180, 50, BTN_COLORS["train"], "train"),
         Button(lambda: LANG_TEXTS[current_lang]["test"],    50, 260, 180, 50, BTN_COLORS["test"], "test"),
         Button(lambda: LANG_TEXTS[current_lang]["log"],     50, 340, 180, 50, BTN_COLORS["log"], "log"),
-        Button(lambda: LANG_TEXTS[current_lang]["quit"],    50, 420, 180, 50, BTN_COLORS["quit"], "quit"),
-        Button(lambda: LANG_TEXTS[current_lang]["lang"],    50, 500, 180, 50, (150,150,50), "lang"),
+        Button(lambda: LANG_TEXTS[current_lang]["metrics"], 50, 420, 180, 50, BTN_COLORS["metrics"], "metrics"),
+        Button(lambda: LANG_TEXTS[current_lang]["quit"],    50, 500, 180, 50, BTN_COLORS["quit"], "quit"),
+        Button(lambda: LANG_TEXTS[current_lang]["lang"],    50, 580, 180, 50, (150,150,50), "lang"),
     ]
 
+    first_frame = True
     run = True
     while run:
+        frame_start = time.perf_counter()
         mouse_pos = pygame.mouse.get_pos()
         WIN.fill(BG_COLOR)
         pygame.draw.rect(WIN, PANEL_COLOR, (0,0,280,HEIGHT))
@@ -201,7 +410,15 @@ def main_menu():
         for btn in buttons:
             btn.draw(WIN, mouse_pos)
 
+        update_training()
+        draw_training_status(WIN)
+
         pygame.display.update()
+        if first_frame:
+            first_frame = False
+            print_startup_report(time.perf_counter() - _START_TIME)
+            if WARM_UP:
+                warm_up()
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -211,15 +428,20 @@ def main_menu():
                 for btn in buttons:
                     if btn.is_clicked((mx,my)):
                         btn.pressed = True
-                        winsound.Beep(700,100)
+                        beep(700,100)
                         if btn.action=="collect":
-                            Trajectory.collect_data()
+                            lazy_import("Trajectory").collect_data()
                         elif btn.action=="train":
-                            train_model.train_model("mouse_dataset.jsonl")
+                            if training_job is None:
+                                start_training()
+                            else:
+                                training_job.cancel()
                         elif btn.action=="test":
                             test_page()
                         elif btn.action=="log":
                             log_page()
+                        elif btn.action=="metrics":
+                            metrics_page()
                         elif btn.action=="quit":
                             run=False
                         elif btn.action=="lang":
@@ -228,8 +450,11 @@ def main_menu():
                 for btn in buttons:
                     btn.pressed = False
 
+        metrics.record("frame.menu", time.perf_counter() - frame_start, frame_start)
         clock.tick(60)
 
+    if training_job is not None:
+        training_job.cancel()
     pygame.quit()
     sys.exit()
 
@@ -240,9 +465,15 @@ def test_page():
     active_box = None
     test_traj = None
     test_dx, test_dy = 0, 0
+    # 版本 0 是工作目錄的 mouse_traj.onnx，之後是 model_cache/ 中的各版本 (新的在前)，直接從快取目錄推論
+    model_cache = lazy_import("artifact_cache").ArtifactCache()
+    versions = [None] + model_cache.entries()
+    version = 0
+    version_path = lambda meta: "mouse_traj.onnx" if meta is None else model_cache.model_path(meta)
 
     run = True
     while run:
+        frame_start = time.perf_counter()
         WIN.fill(BG_COLOR)
         title = FONT.render(LANG_TEXTS[current_lang]["test_title"], True, WHITE)
         WIN.blit(title, (50,40))
@@ -255,6 +486,12 @@ def test_page():
         txt2 = FONT.render(dy_input or "dy", True, WHITE)
         WIN.blit(txt1, (dx_rect.centerx - txt1.get_width()//2, dx_rect.centery - txt1.get_height()//2))
         WIN.blit(txt2, (dy_rect.centerx - txt2.get_width()//2, dy_rect.centery - txt2.get_height()//2))
+        if versions[version] is None:
+            label = LANG_TEXTS[current_lang]["model_current"]
+        else:
+            label = (f"{LANG_TEXTS[current_lang]['model_version']} {version}/{len(versions) - 1}: "
+                     f"{lazy_import('artifact_cache').describe(versions[version])}")
+        WIN.blit(safe_render(label, FONT_SMALL, WHITE), (300, 110))
 
         # 畫布
         canvas = pygame.Surface((WIDTH-300, HEIGHT-150))
@@ -268,6 +505,7 @@ def test_page():
                 pygame.draw.lines(canvas, (100,150,255), False, pts, 3)
         WIN.blit(canvas, (280,150))
 
+        update_training()
         pygame.display.update()
 
         for event in pygame.event.get():
@@ -276,6 +514,18 @@ def test_page():
             elif event.type==pygame.KEYDOWN:
                 if event.key==pygame.K_ESCAPE:
                     run=False
+                elif event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                    # 每次切換都重新列出，訓練完成或被淘汰的版本會即時反映
+                    current = versions[version]
+                    versions = [None] + model_cache.entries()
+                    keys = [v and v["key"] for v in versions]
+                    version = keys.index(current["key"]) if current is not None and current["key"] in keys else 0
+                    version = (version + (1 if event.key == pygame.K_RIGHT else -1)) % len(versions)
+                    # 每個版本各有 session、背景執行緒與網格 mmap，離開的快取版本要釋放，不然切過幾個就累積幾份
+                    if current is not None and keys[version] != current["key"]:
+                        release_model(version_path(current))
+                    if test_traj is not None:
+                        test_traj = test_model_main(test_dx, test_dy, version_path(versions[version]))
                 elif active_box:
                     if event.key==pygame.K_BACKSPACE:
                         if active_box=="dx": dx_input=dx_input[:-1]
@@ -286,7 +536,7 @@ def test_page():
                 if event.key==pygame.K_RETURN:
                     try: dx=int(dx_input); dy=int(dy_input)
                     except: dx,dy=100,50
-                    test_traj=test_model_main(dx,dy)
+                    test_traj=test_model_main(dx,dy,version_path(versions[version]))
                     test_dx,test_dy=dx,dy
             elif event.type==pygame.MOUSEBUTTONDOWN:
                 mx,my=event.pos
@@ -294,27 +544,32 @@ def test_page():
                 elif dy_rect.collidepoint((mx,my)): active_box="dy"
                 else: active_box=None
 
+        metrics.record("frame.test", time.perf_counter() - frame_start, frame_start)
         clock.tick(60)
+    if versions[version] is not None:
+        release_model(version_path(versions[version]))
 
 # ===================== 日誌頁面 =====================
 def log_page():
     clock = pygame.time.Clock()
+    log_area = pygame.Surface((WIDTH-100, HEIGHT-150))
     scroll_offset = 0
     scroll_dragging = False
     scrollbar_rect = None
     run = True
 
     while run:
+        frame_start = time.perf_counter()
         WIN.fill(BG_COLOR)
         title = FONT.render(LANG_TEXTS[current_lang]["log_title"], True, WHITE)
         WIN.blit(title,(50,40))
 
-        log_area = pygame.Surface((WIDTH-100, HEIGHT-150))
         log_area.fill(CANVAS_COLOR)
-        draw_logs(log_area, log_buffer.lines, scroll_offset)
+        total_rows = draw_logs(log_area, log_view, scroll_offset)
         WIN.blit(log_area, (50,100))
 
-        scrollbar_rect = draw_scrollbar(WIN, len(log_buffer.lines), scroll_offset)
+        scrollbar_rect = draw_scrollbar(WIN, total_rows, scroll_offset)
+        update_training()
 
         pygame.display.update()
 
@@ -334,12 +589,85 @@ def log_page():
                 scroll_dragging = False
             elif event.type==pygame.MOUSEMOTION and scroll_dragging:
                 visible_height = HEIGHT - 150
-                content_height = max(1, len(log_buffer.lines) * FONT_SMALL.get_linesize())
+                content_height = max(1, total_rows * FONT_SMALL.get_linesize())
                 bar_height = max(40, visible_height * visible_height // content_height)
                 new_y = event.pos[1] - drag_offset - 100
                 new_y = max(0, min(new_y, visible_height - bar_height))
                 scroll_offset = int(new_y * content_height / visible_height)
 
+        metrics.record("frame.log", time.perf_counter() - frame_start, frame_start)
+        clock.tick(60)
+
+# ===================== 效能監控頁面 =====================
+HIST_BINS = 24
+HIST_COLOR = (52, 152, 219)
+
+def draw_histogram(surface, samples, rect):
+    # 以對數刻度分箱，顯示最近的樣本分布
+    pygame.draw.rect(surface, INPUT_BG, rect)
+    samples = [v for v in samples if v > 0]
+    if len(samples) < 2:
+        return
+    lo, hi = math.log10(min(samples)), math.log10(max(samples))
+    span = max(hi - lo, 1e-9)
+    bins = [0] * HIST_BINS
+    for v in samples:
+        bins[min(HIST_BINS - 1, int((math.log10(v) - lo) / span * HIST_BINS))] += 1
+    peak = max(bins)
+    bar_w = rect.width / HIST_BINS
+    for i, c in enumerate(bins):
+        h = int(rect.height * c / peak)
+        if h:
+            pygame.draw.rect(surface, HIST_COLOR, (rect.x + int(i * bar_w), rect.bottom - h, max(1, int(bar_w) - 1), h))
+
+def metrics_page():
+    clock = pygame.time.Clock()
+    run = True
+    while run:
+        frame_start = time.perf_counter()
+        WIN.fill(BG_COLOR)
+        title = FONT.render(LANG_TEXTS[current_lang]["metrics_title"], True, WHITE)
+        WIN.blit(title, (50,40))
+        update_training()
+
+        if not metrics.ENABLED:
+            WIN.blit(FONT_SMALL.render(LANG_TEXTS[current_lang]["metrics_off"], True, WHITE), (50,100))
+        else:
+            snap = metrics.snapshot()
+            columns = [("name", 50), ("count", 300), ("mean ms", 380), ("p50", 480), ("p95", 560), ("max", 640)]
+            for text, x in columns:
+                WIN.blit(FONT_SMALL.render(text, True, WHITE), (x,100))
+            y = 130
+            for name in sorted(snap["timers"]):
+                st = snap["timers"][name]
+                values = [name, str(st["count"]), f"{st['mean_s']*1e3:.2f}", f"{st['p50_s']*1e3:.2f}",
+                          f"{st['p95_s']*1e3:.2f}", f"{st['max_s']*1e3:.2f}"]
+                for text, (_, x) in zip(values, columns):
+                    WIN.blit(FONT_SMALL.render(text, True, WHITE), (x,y))
+                draw_histogram(WIN, metrics.recent_samples(name), pygame.Rect(WIDTH-260, y+2, 210, 20))
+                y += 28
+                if y > HEIGHT - 60:
+                    break
+            counters = "  ".join(f"{k}={v}" for k, v in sorted(snap["counters"].items()))
+            if counters:
+                WIN.blit(FONT_SMALL.render(counters, True, WHITE), (50, HEIGHT-40))
+
+        pygame.display.update()
+
+        for event in pygame.event.get():
+            if event.type==pygame.QUIT:
+                run=False
+            elif event.type==pygame.KEYDOWN:
+                if event.key==pygame.K_ESCAPE:
+                    run=False
+                elif event.key==pygame.K_e:
+                    metrics.enable(not metrics.ENABLED)
+                elif event.key==pygame.K_r:
+                    metrics.reset()
+                elif event.key==pygame.K_d:
+                    print(f"Metrics saved -> {metrics.dump_json()}, {metrics.dump_chrome_trace()}")
+
+        metrics.record("frame.metrics", time.perf_counter() - frame_start, frame_start)
         clock.tick(60)
 
 if __name__=="__main__":
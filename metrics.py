@@ -0,0 +1,121 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+# 輕量的計時 / 計數工具：關閉時 timer() 只回傳共用的空 context，幾乎沒有成本
+# 開啟方式：環境變數 MTN_METRICS=1，或呼叫 enable()
+# dump_json() 輸出統計，dump_chrome_trace() 輸出可用 chrome://tracing / Perfetto 開啟的檔案
+
+ENABLED = os.environ.get("MTN_METRICS", "") not in ("", "0")
+SAMPLE_CAPACITY = 2048     # 每個項目保留最近幾筆用於百分位數與直方圖
+TRACE_CAPACITY = 100000    # chrome trace 最多保留幾個事件
+
+_NULL = contextlib.nullcontext()
+_lock = threading.Lock()
+_stats = {}
+_counters = collections.Counter()
+_trace = collections.deque(maxlen=TRACE_CAPACITY)
+_origin = time.perf_counter()
+
+class Stat:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=SAMPLE_CAPACITY)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+    def summary(self):
+        return {"count": self.count, "total_s": self.total, "mean_s": self.total / max(self.count, 1),
+                "min_s": self.min if self.count else 0.0, "max_s": self.max,
+                "p50_s": self.percentile(50), "p95_s": self.percentile(95), "p99_s": self.percentile(99)}
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        record(self.name, end - self.start, self.start)
+        return False
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+def timer(name):
+    return _Timer(name) if ENABLED else _NULL
+
+def record(name, seconds, start=None):
+    if not ENABLED:
+        return
+    if start is None:
+        start = time.perf_counter() - seconds
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.add(seconds)
+        _trace.append((name, start, seconds, threading.get_ident()))
+
+def count(name, n=1):
+    if ENABLED:
+        with _lock:
+            _counters[name] += n
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _counters.clear()
+        _trace.clear()
+
+def snapshot():
+    with _lock:
+        return {"timers": {name: stat.summary() for name, stat in _stats.items()},
+                "counters": dict(_counters)}
+
+def recent_samples(name):
+    with _lock:
+        stat = _stats.get(name)
+        return list(stat.recent) if stat else []
+
+def dump_json(path="metrics.json"):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2)
+    return path
+
+def dump_chrome_trace(path="metrics_trace.json"):
+    pid = os.getpid()
+    with _lock:
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                   "ts": (start - _origin) * 1e6, "dur": seconds * 1e6}
+                  for name, start, seconds, tid in _trace]
+        counters = dict(_counters)
+    if counters:
+        events.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+                       "ts": (time.perf_counter() - _origin) * 1e6, "args": counters})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
@@ -0,0 +1,132 @@
+import time
+import numpy as np
+
+# 純 NumPy 推理：把 TrajNet 的 nn.Linear 權重抽成 .npz，前向傳播只用預先配置好的緩衝區
+# 匯入本模組只需要 numpy，不必載入 torch / onnxruntime
+
+SUPPORTED_OPS = {"Gemm", "MatMul", "Add", "Relu", "Identity"}
+
+def weights_from_model(model):
+    # TrajNet -> [(W, b), ...]，W 轉為 (in, out) 以便 x @ W；有正規化時先併入權重
+    import torch.nn as nn
+    if hasattr(model, "folded"):
+        model = model.folded()
+    layers = []
+    for m in model.modules():
+        if isinstance(m, nn.Linear):
+            w = m.weight.detach().cpu().numpy().astype(np.float32)
+            b = m.bias.detach().cpu().numpy().astype(np.float32)
+            layers.append((np.ascontiguousarray(w.T), b))
+    return layers
+
+def weights_from_onnx(onnx_path):
+    # 依圖中節點順序讀取 Gemm (或 MatMul + Add) 的 initializer；
+    # 圖中有其他運算 (例如未併入權重的正規化) 時無法只用線性層重現，直接報錯
+    import onnx
+    from onnx import numpy_helper
+    graph = onnx.load(onnx_path).graph
+    unsupported = {node.op_type for node in graph.node} - SUPPORTED_OPS
+    if unsupported:
+        raise ValueError(f"{onnx_path} contains ops the NumPy backend cannot run: {sorted(unsupported)}")
+    inits = {i.name: numpy_helper.to_array(i).astype(np.float32) for i in graph.initializer}
+    layers = []
+    pending = None
+    for node in graph.node:
+        if node.op_type == "Gemm":
+            attrs = {a.name: a for a in node.attribute}
+            w = inits[node.input[1]]
+            if "transB" in attrs and attrs["transB"].i:
+                w = w.T
+            b = inits[node.input[2]] if len(node.input) > 2 else np.zeros(w.shape[1], np.float32)
+            layers.append((np.ascontiguousarray(w), b))
+        elif node.op_type == "MatMul" and node.input[1] in inits:
+            pending = np.ascontiguousarray(inits[node.input[1]])
+        elif node.op_type == "Add" and pending is not None:
+            bias_name = node.input[1] if node.input[1] in inits else node.input[0]
+            layers.append((pending, inits[bias_name]))
+            pending = None
+    if not layers:
+        raise ValueError(f"No linear layers found in {onnx_path}")
+    return layers
+
+def save_npz(layers, npz_path="mouse_traj.npz"):
+    arrays = {}
+    for i, (w, b) in enumerate(layers):
+        arrays[f"w{i}"] = w
+        arrays[f"b{i}"] = b
+    np.savez(npz_path, **arrays)
+    print(f"NumPy weights saved as {npz_path}")
+
+def export_npz(source="mouse_traj.onnx", npz_path="mouse_traj.npz"):
+    # source 可為 ONNX 路徑或已訓練的 TrajNet
+    layers = weights_from_onnx(source) if isinstance(source, str) else weights_from_model(source)
+    save_npz(layers, npz_path)
+    return npz_path
+
+class NumpyTrajNet:
+    def __init__(self, npz_path="mouse_traj.npz", max_batch=1024):
+        with np.load(npz_path) as data:
+            n = len([k for k in data.files if k.startswith("w")])
+            self.layers = [(np.ascontiguousarray(data[f"w{i}"], dtype=np.float32),
+                            np.ascontiguousarray(data[f"b{i}"], dtype=np.float32)) for i in range(n)]
+        self.max_batch = max_batch
+        self._input = np.zeros((max_batch, self.layers[0][0].shape[0]), dtype=np.float32)
+        self._buffers = [np.zeros((max_batch, w.shape[1]), dtype=np.float32) for w, _ in self.layers]
+
+    def _forward(self, n):
+        x = self._input[:n]
+        last = len(self.layers) - 1
+        for i, (w, b) in enumerate(self.layers):
+            out = self._buffers[i][:n]
+            np.matmul(x, w, out=out)
+            out += b
+            if i != last:
+                np.maximum(out, 0, out=out)
+            x = out
+        return x
+
+    def predict(self, dx, dy):
+        self._input[0, 0] = dx
+        self._input[0, 1] = dy
+        return self._forward(1).reshape(10, 2).copy()
+
+    def predict_batch(self, moves, out=None):
+        moves = np.asarray(moves, dtype=np.float32).reshape(-1, 2)
+        n = len(moves)
+        if out is None:
+            out = np.empty((n, 10, 2), dtype=np.float32)
+        flat = out.reshape(n, 20)
+        for i in range(0, n, self.max_batch):
+            m = min(self.max_batch, n - i)
+            self._input[:m] = moves[i:i + m]
+            flat[i:i + m] = self._forward(m)
+        return out
+
+def check_against_onnx(onnx_path="mouse_traj.onnx", npz_path="mouse_traj.npz", n=10000, seed=0):
+    import onnxruntime as ort
+    moves = np.random.default_rng(seed).uniform(-800, 800, (n, 2)).astype(np.float32)
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    ref = session.run(None, {"input": moves})[0].reshape(n, 10, 2)
+    got = NumpyTrajNet(npz_path).predict_batch(moves)
+    return float(np.abs(got - ref).max())
+
+def benchmark(npz_path="mouse_traj.npz", single_calls=10000, batch=100000):
+    net = NumpyTrajNet(npz_path)
+    net.predict(1, 1)
+    start = time.perf_counter()
+    for i in range(single_calls):
+        net.predict(i % 300, 50)
+    single_us = (time.perf_counter() - start) / single_calls * 1e6
+
+    moves = np.random.default_rng(0).uniform(-800, 800, (batch, 2)).astype(np.float32)
+    out = np.empty((batch, 10, 2), dtype=np.float32)
+    start = time.perf_counter()
+    net.predict_batch(moves, out=out)
+    batch_rate = batch / (time.perf_counter() - start)
+    return {"single_us": single_us, "batch_per_s": batch_rate}
+
+if __name__ == "__main__":
+    export_npz("mouse_traj.onnx", "mouse_traj.npz")
+    print(f"max abs diff vs ONNX: {check_against_onnx():.2e}")
+    stats = benchmark()
+    print(f"single call: {stats['single_us']:.1f} us, batch: {stats['batch_per_s']:.0f} samples/s")
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# 不需要顯示器的批次推理：從 CSV / JSONL / NPY 串流讀入 (dx, dy)，分批送進模型，
+# 結果以串流方式寫出為 JSONL 或 N×10×2 的 .npy；同時在處理中的批次數有上限，記憶體用量固定
+#   python predict_cli.py moves.csv -o traj.npy --batch-size 65536 --workers 4 --intra-op-threads 1
+
+_PUNCTUATION = bytes.maketrans(b",;\t", b"   ")
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+def _csv_batch(path, rows, linenos):
+    try:
+        return np.array(rows, dtype=np.float32)
+    except ValueError:
+        for row, lineno in zip(rows, linenos):
+            if not all(_is_number(t) for t in row):
+                raise ValueError(f"{path}:{lineno}: dx / dy must be numbers, got {b' '.join(row).decode(errors='replace')!r}")
+        raise
+
+def read_csv(path, batch_size):
+    # 只取每列前兩欄；第一列若不是數字就當作標題略過。每批剛好 batch_size 列 (最後一批除外)，
+    # 欄位不足兩欄的列直接報錯並指出行號
+    with open(path, "rb") as f:
+        rows, linenos = [], []
+        for lineno, line in enumerate(f, 1):
+            tokens = line.translate(_PUNCTUATION).split()[:2]
+            if not tokens or (lineno == 1 and not all(_is_number(t) for t in tokens)):
+                continue
+            if len(tokens) < 2:
+                raise ValueError(f"{path}:{lineno}: expected two columns (dx, dy), got {line.strip().decode(errors='replace')!r}")
+            rows.append(tokens)
+            linenos.append(lineno)
+            if len(rows) == batch_size:
+                yield _csv_batch(path, rows, linenos)
+                rows, linenos = [], []
+        if rows:
+            yield _csv_batch(path, rows, linenos)
+
+def _move_from_json(obj):
+    if isinstance(obj, dict):
+        obj = obj.get("relative_move", obj)
+        return obj["dx"], obj["dy"]
+    return obj[0], obj[1]
+
+def read_jsonl(path, batch_size):
+    with open(path, "rb") as f:
+        moves = []
+        for line in f:
+            if not line.strip():
+                continue
+            moves.append(_move_from_json(json.loads(line)))
+            if len(moves) == batch_size:
+                yield np.array(moves, dtype=np.float32)
+                moves = []
+        if moves:
+            yield np.array(moves, dtype=np.float32)
+
+def read_npy(path, batch_size):
+    data = np.load(path, mmap_mode="r")
+    data = data.reshape(len(data), -1)
+    for i in range(0, len(data), batch_size):
+        yield np.ascontiguousarray(data[i:i + batch_size, :2], dtype=np.float32)
+
+READERS = {".csv": read_csv, ".txt": read_csv, ".jsonl": read_jsonl, ".json": read_jsonl, ".npy": read_npy}
+
+class NpyStreamWriter:
+    # 先預留固定長度的標頭，寫完後再填入實際筆數，不需要事先知道 N
+    HEADER_LEN = 128
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.f = open(path, "wb")
+        self.f.write(self._header(0))
+
+    def _header(self, n):
+        desc = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, 10, 2), }" % n
+        body_len = self.HEADER_LEN - 10
+        desc = desc.ljust(body_len - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + body_len.to_bytes(2, "little") + desc.encode("latin1")
+
+    def write(self, moves, trajs):
+        self.f.write(np.ascontiguousarray(trajs, dtype="<f4").tobytes())
+        self.count += len(trajs)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self._header(self.count))
+        self.f.close()
+
+class JsonlStreamWriter:
+    def __init__(self, path):
+        self.f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+        self.line_fmt = '{"dx": %g, "dy": %g, "trajectory": [' + ", ".join(["[%.2f, %.2f]"] * 10) + "]}\n"
+
+    def write(self, moves, trajs):
+        rows = np.concatenate([moves, trajs.reshape(len(trajs), 20)], axis=1).tolist()
+        self.f.write("".join(self.line_fmt % tuple(row) for row in rows))
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+def make_predictor(model_path, backend, workers, intra_op_threads, dataset="mouse_dataset.jsonl", use_variant=True):
+    if backend == "retrieval":
+        # 索引建好後唯讀，多執行緒共用同一份
+        import retrieval_backend
+        return retrieval_backend.RetrievalTrajNet(dataset).predict_batch, None
+    if backend == "numpy":
+        import numpy_backend
+        npz_path = os.path.splitext(model_path)[0] + ".npz"
+        if not os.path.exists(npz_path):
+            numpy_backend.export_npz(model_path, npz_path)
+        local = threading.local()
+
+        def predict(moves):
+            # 每個執行緒各自一份預先配置的緩衝區
+            net = getattr(local, "net", None)
+            if net is None:
+                net = local.net = numpy_backend.NumpyTrajNet(npz_path, max_batch=min(len(moves), 65536))
+            return net.predict_batch(moves)
+        return predict, None
+
+    import test_model
+    # 預設載入 variants.json 推薦的最佳化 / INT8 版本
+    engine = test_model.InferenceEngine(model_path, pool_size=workers, intra_op_threads=intra_op_threads,
+                                        use_variant=use_variant)
+    return engine.predict_batch, engine
+
+def run(input_path, output_path, model_path="mouse_traj.onnx", batch_size=65536, workers=None,
+        intra_op_threads=1, backend="onnx", input_format=None, output_format=None, quiet=False,
+        dataset="mouse_dataset.jsonl", use_variant=True):
+    workers = workers or max(1, (os.cpu_count() or 1) // max(1, intra_op_threads))
+    in_ext = input_format or os.path.splitext(input_path)[1].lower()
+    out_ext = output_format or (".npy" if output_path.endswith(".npy") else ".jsonl")
+    if in_ext not in READERS:
+        raise ValueError(f"Unsupported input format: {in_ext}")
+
+    predict, engine = make_predictor(model_path, backend, workers, intra_op_threads, dataset, use_variant)
+    if engine is not None and not quiet:
+        print(f"Using {engine.session_path}", file=sys.stderr)
+    writer = NpyStreamWriter(output_path) if out_ext == ".npy" else JsonlStreamWriter(output_path)
+    max_in_flight = workers * 2
+    done = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            in_flight = []
+            for moves in READERS[in_ext](input_path, batch_size):
+                in_flight.append((moves, pool.submit(predict, moves)))
+                # 依序寫出最早的批次，讓記憶體中的批次數維持在上限內
+                while len(in_flight) >= max_in_flight or (in_flight and in_flight[0][1].done()):
+                    m, fut = in_flight.pop(0)
+                    writer.write(m, fut.result())
+                    done += len(m)
+                if not quiet:
+                    rate = done / max(time.perf_counter() - start, 1e-9)
+                    print(f"\r{done} rows, {rate:.0f} rows/s", end="", file=sys.stderr)
+            for m, fut in in_flight:
+                writer.write(m, fut.result())
+                done += len(m)
+    finally:
+        writer.close()
+        if engine is not None:
+            engine.close()
+    elapsed = time.perf_counter() - start
+    if not quiet:
+        print(f"\r{done} rows in {elapsed:.2f}s ({done / max(elapsed, 1e-9):.0f} rows/s) -> {output_path}",
+              file=sys.stderr)
+    return done
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch trajectory prediction from (dx, dy) files")
+    parser.add_argument("input", help="CSV / JSONL / NPY file of (dx, dy)")
+    parser.add_argument("-o", "--output", required=True, help=".jsonl, .npy (N x 10 x 2) or - for stdout")
+    parser.add_argument("-m", "--model", default="mouse_traj.onnx")
+    parser.add_argument("--backend", choices=("onnx", "numpy", "retrieval"), default="onnx")
+    parser.add_argument("--dataset", default="mouse_dataset.jsonl", help="recorded trajectories for --backend retrieval")
+    parser.add_argument("--batch-size", type=int, default=65536)
+    parser.add_argument("--workers", type=int, default=None, help="thread pool size (default: cores / intra-op threads)")
+    parser.add_argument("--intra-op-threads", type=int, default=1)
+    parser.add_argument("--input-format", choices=sorted(READERS), default=None)
+    parser.add_argument("--fp32", action="store_true",
+                        help="load the fp32 model even when <model>.variants.json recommends another variant")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+    try:
+        run(args.input, args.output, args.model, args.batch_size, args.workers, args.intra_op_threads,
+            args.backend, args.input_format, quiet=args.quiet, dataset=args.dataset, use_variant=not args.fp32)
+    except ValueError as e:
+        print(f"\nError: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
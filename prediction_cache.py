@@ -0,0 +1,115 @@
+import collections
+import json
+import os
+import threading
+import numpy as np
+
+from dataset_cache import file_digest
+import metrics
+
+# 預測快取：dx / dy 在存檔時已四捨五入成整數，實際會查詢的位移只有幾十萬種
+#   1. 預先算好的網格 <name>.grid.npy，形狀 (2W+1, 2H+1, 10, 2)，以 mmap 開啟，查詢只是陣列索引
+#   2. 網格範圍外或非整數的位移走有上限的 LRU
+# 網格旁的 <name>.grid.json 記錄模型雜湊，模型改變後網格視為失效
+
+# 預設涵蓋 800x600 收集視窗從中心出發的所有位移 (約 38 MB)；測試頁可以輸入更大的位移，
+# 超出網格的查詢照常推理並放進 LRU，只是不會是 O(1) 的查表。需要更大範圍時以 half_w / half_h 建網格
+GRID_HALF_W = 400
+GRID_HALF_H = 300
+LRU_CAPACITY = 65536
+
+def grid_paths(model_path):
+    base = os.path.splitext(model_path)[0]
+    return base + ".grid.npy", base + ".grid.json"
+
+def model_hash(model_path):
+    # 新版 torch 匯出的權重在 <name>.onnx.data，一併納入
+    digest = file_digest(model_path)
+    data_path = model_path + ".data"
+    if os.path.exists(data_path):
+        digest += file_digest(data_path)
+    return digest
+
+def build_grid(model_path, predict_batch, half_w=GRID_HALF_W, half_h=GRID_HALF_H, chunk=65536):
+    # 一次批次推理填滿整個網格；先寫暫存檔再改名，中途失敗不會留下半成品
+    grid_path, meta_path = grid_paths(model_path)
+    tmp_path = grid_path + ".tmp.npy"
+    with metrics.timer("cache.build_grid"):
+        grid = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                         shape=(2 * half_w + 1, 2 * half_h + 1, 10, 2))
+        flat = grid.reshape(-1, 10, 2)
+        dy_values = np.arange(-half_h, half_h + 1, dtype=np.float32)
+        rows_per_chunk = max(1, chunk // len(dy_values))
+        moves = np.empty((rows_per_chunk * len(dy_values), 2), dtype=np.float32)
+        for x0 in range(0, 2 * half_w + 1, rows_per_chunk):
+            x1 = min(x0 + rows_per_chunk, 2 * half_w + 1)
+            n = (x1 - x0) * len(dy_values)
+            moves[:n, 0] = np.repeat(np.arange(x0, x1, dtype=np.float32) - half_w, len(dy_values))
+            moves[:n, 1] = np.tile(dy_values, x1 - x0)
+            flat[x0 * len(dy_values):x0 * len(dy_values) + n] = predict_batch(moves[:n])
+        grid.flush()
+        del grid, flat
+        os.replace(tmp_path, grid_path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"model_hash": model_hash(model_path), "half_w": half_w, "half_h": half_h}, f)
+    return grid_path
+
+def load_grid(model_path, mmap=True):
+    # 回傳 (grid, half_w, half_h)；網格不存在或與目前模型不符時回傳 None
+    grid_path, meta_path = grid_paths(model_path)
+    if not (os.path.exists(grid_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model_hash") != model_hash(model_path):
+            return None
+        grid = np.load(grid_path, mmap_mode="r" if mmap else None)
+    except (OSError, ValueError):
+        return None
+    if grid.shape != (2 * meta["half_w"] + 1, 2 * meta["half_h"] + 1, 10, 2):
+        return None
+    return grid, meta["half_w"], meta["half_h"]
+
+class PredictionCache:
+    # engine 需提供 predict(dx, dy)；回傳的陣列是唯讀的，多個呼叫端共用
+    def __init__(self, model_path, engine, capacity=LRU_CAPACITY, use_grid=True):
+        self.engine = engine
+        self.capacity = capacity
+        self.grid = None
+        if use_grid:
+            loaded = load_grid(model_path)
+            if loaded is not None:
+                self.grid, self.half_w, self.half_h = loaded
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def predict(self, dx, dy):
+        if self.grid is not None:
+            ix, iy = int(dx), int(dy)
+            if ix == dx and iy == dy and abs(ix) <= self.half_w and abs(iy) <= self.half_h:
+                metrics.count("cache.grid_hit")
+                return self.grid[ix + self.half_w, iy + self.half_h]
+
+        key = (float(dx), float(dy))
+        with self._lock:
+            traj = self._lru.get(key)
+            if traj is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                metrics.count("cache.lru_hit")
+                return traj
+        traj = np.array(self.engine.predict(dx, dy), dtype=np.float32)
+        traj.setflags(write=False)
+        with self._lock:
+            self.misses += 1
+            self._lru[key] = traj
+            if len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+        metrics.count("cache.miss")
+        return traj
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
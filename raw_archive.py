@@ -0,0 +1,253 @@
+import argparse
+import os
+import time
+import zlib
+import numpy as np
+
+from resample import interpolate_batch
+
+# 原始軌跡封存檔：收集時把完整解析度的取樣點另外存成二進位，之後可以重切成任意點數
+#   <name>.raw      magic + 逐筆紀錄：xy 差分 int16 (n, 2) 接 時間 uint32 微秒 (n,)
+#                   第一個點是絕對座標，之後都是與前一點的差；時間從該筆第一個點起算
+#   <name>.raw.idx  magic + 固定寬度索引 (offset, count, created, line, crc)，讀取時用 mmap 直接定位
+#                   line / crc 是對應 JSONL 那一行的起始位移與 CRC32，兩個檔案各自寫入與回復，
+#                   只靠位置對應的話當機或回復後會錯位，讀取時以這兩個值確認是同一筆
+# 只會在檔尾 append；撤銷 (undo) 只會 truncate 本次收集寫入的部分，與 SessionWriter 相同
+# 寫入順序為 JSONL -> 資料 -> 索引，索引之後多出的資料 (存到一半中斷) 在下次開啟時截掉，
+# 尾端連結的 JSONL 行已經不存在或內容不同的紀錄 (JSONL 回復、存檔中途當機後又改寫) 也一併截掉
+
+DATA_MAGIC = b"MTRAW1\0\0"
+INDEX_MAGIC = b"MTIDX2\0\0"
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("count", "<u4"), ("created", "<u4"), ("line", "<u8"), ("crc", "<u4")])
+NO_LINE = np.iinfo(np.uint64).max  # 沒有對應 JSONL 的紀錄 (例如 benchmark 直接寫入)
+
+def archive_paths(jsonl_file):
+    base = os.path.splitext(jsonl_file)[0]
+    return base + ".raw", base + ".raw.idx"
+
+def encode(points, times):
+    # points: (n, 2) 絕對整數座標；times: (n,) 秒 -> 一筆紀錄的 bytes
+    pts = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    deltas = np.empty_like(pts)
+    deltas[:1] = pts[:1]
+    np.subtract(pts[1:], pts[:-1], out=deltas[1:])
+    if len(pts) and (deltas.min() < -32768 or deltas.max() > 32767):
+        raise ValueError("trajectory coordinates do not fit in int16")
+    t = np.asarray(times, dtype=np.float64)
+    t_us = np.rint((t - t[0]) * 1e6) if len(t) else t
+    if len(t) and (t_us.min() < 0 or t_us.max() > 0xFFFFFFFF):
+        raise ValueError("trajectory timestamps must be increasing and span less than ~71 minutes")
+    return deltas.astype("<i2").tobytes() + t_us.astype("<u4").tobytes()
+
+def _valid_length(path, magic, unit):
+    # 回傳檔案中完整可用的長度 (去掉寫到一半的尾巴)；檔案不存在時為 None
+    if not os.path.exists(path):
+        return None
+    size = os.path.getsize(path)
+    if size < len(magic):
+        return len(magic)
+    with open(path, "rb") as f:
+        head = f.read(len(magic))
+        if head != magic:
+            if head[:5] == magic[:5]:
+                raise ValueError(f"{path} was written by an older version without JSONL links, remove it to start a new archive")
+            raise ValueError(f"{path} is not a raw trajectory archive")
+    return len(magic) + (size - len(magic)) // unit * unit
+
+class RawArchiveWriter:
+    def __init__(self, jsonl_file="mouse_dataset.jsonl", fsync=True):
+        # JSONL 的 SessionWriter 要先建立 (先做完它的回復)，這裡才能和回復後的內容對齊
+        self.jsonl_file = jsonl_file
+        self.data_path, self.index_path = archive_paths(jsonl_file)
+        self.fsync = fsync
+        self.recover()
+        self.session_start = (os.path.getsize(self.index_path) - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        self.saved = []     # 已寫入的 (points, times) 物件，用來找出與上次存檔相同的前綴
+        self.links = []     # 已寫入紀錄對應的 (JSONL 位移, CRC32)
+        self.ends = []      # 每筆紀錄結束時的資料檔位移
+
+    def recover(self):
+        index_len = _valid_length(self.index_path, INDEX_MAGIC, INDEX_DTYPE.itemsize)
+        data_len = _valid_length(self.data_path, DATA_MAGIC, 1)
+        for path, magic, length in ((self.index_path, INDEX_MAGIC, index_len), (self.data_path, DATA_MAGIC, data_len)):
+            if length is None:
+                with open(path, "wb") as f:
+                    f.write(magic)
+            elif os.path.getsize(path) != length:
+                with open(path, "r+b") as f:
+                    f.truncate(length)
+                    f.seek(0)
+                    f.write(magic)
+        index = np.fromfile(self.index_path, dtype=INDEX_DTYPE, offset=len(INDEX_MAGIC))
+        keep = self._linked_prefix(index)
+        if keep < len(index):
+            os.truncate(self.index_path, len(INDEX_MAGIC) + keep * INDEX_DTYPE.itemsize)
+            print(f"Recovered {self.index_path}: dropped {len(index) - keep} records no longer in {self.jsonl_file}")
+            index = index[:keep]
+        end = int(index["offset"][-1] + index["count"][-1] * 8) if len(index) else len(DATA_MAGIC)
+        if os.path.getsize(self.data_path) > end:
+            os.truncate(self.data_path, end)
+            print(f"Recovered {self.data_path}: dropped unindexed tail after {end} bytes")
+
+    def _linked_prefix(self, index):
+        # 從最後一筆往前找第一筆仍對得上 JSONL 的紀錄；只有尾端會因為當機 / 回復而失去對應
+        keep = len(index)
+        if keep == 0 or index["line"][-1] == NO_LINE:
+            return keep
+        if not os.path.exists(self.jsonl_file):
+            return int(np.count_nonzero(np.cumprod(index["line"] == NO_LINE)))
+        with open(self.jsonl_file, "rb") as f:
+            while keep > 0 and index["line"][keep - 1] != NO_LINE:
+                f.seek(int(index["line"][keep - 1]))
+                line = f.readline()
+                if line.endswith(b"\n") and zlib.crc32(line) == index["crc"][keep - 1]:
+                    break
+                keep -= 1
+        return keep
+
+    def _truncate(self, keep):
+        data_end = self.ends[keep - 1] if keep else None
+        if data_end is None:
+            index = np.fromfile(self.index_path, dtype=INDEX_DTYPE, offset=len(INDEX_MAGIC),
+                                count=self.session_start)
+            data_end = int(index["offset"][-1] + index["count"][-1] * 8) if len(index) else len(DATA_MAGIC)
+        os.truncate(self.index_path, len(INDEX_MAGIC) + (self.session_start + keep) * INDEX_DTYPE.itemsize)
+        os.truncate(self.data_path, data_end)
+        return data_end
+
+    def save(self, raw, links=None):
+        # raw: [(points, times), ...]，與 collect_data 的 dataset 一一對應
+        # links: 每筆對應 JSONL 行的 (起始位移, CRC32)，即 SessionWriter.record_links()；None 表示不連結
+        links = list(links) if links is not None else [(NO_LINE, 0)] * len(raw)
+        if len(links) != len(raw):
+            raise ValueError(f"{len(raw)} raw trajectories but {len(links)} JSONL links")
+        keep = 0
+        while (keep < min(len(raw), len(self.saved)) and raw[keep] is self.saved[keep]
+               and links[keep] == self.links[keep]):
+            keep += 1
+        if keep == len(raw) == len(self.saved):
+            return 0
+
+        offset = self._truncate(keep)
+        ends = self.ends[:keep]
+        entries = np.zeros(len(raw) - keep, dtype=INDEX_DTYPE)
+        now = int(time.time())
+        with open(self.data_path, "ab") as f:
+            for i, (points, times) in enumerate(raw[keep:]):
+                blob = encode(points, times)
+                f.write(blob)
+                entries[i] = (offset, len(blob) // 8, now) + links[keep + i]
+                offset += len(blob)
+                ends.append(offset)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        with open(self.index_path, "ab") as f:
+            f.write(entries.tobytes())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+        self.saved = list(raw)
+        self.links = links
+        self.ends = ends
+        return len(raw) - keep
+
+class RawArchive:
+    # 唯讀；資料檔與索引都以 mmap 開啟，deltas() / times_us() 回傳不複製的 view
+    def __init__(self, jsonl_file="mouse_dataset.jsonl"):
+        data_path, index_path = archive_paths(jsonl_file)
+        entries = (os.path.getsize(index_path) - len(INDEX_MAGIC)) // INDEX_DTYPE.itemsize
+        # 空檔案無法 mmap
+        self.index = (np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", offset=len(INDEX_MAGIC), shape=(entries,))
+                      if entries > 0 else np.zeros(0, dtype=INDEX_DTYPE))
+        self._data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        if bytes(self._data[:len(DATA_MAGIC)]) != DATA_MAGIC:
+            raise ValueError(f"{data_path} is not a raw trajectory archive")
+        # 只信任完整寫入資料檔的紀錄
+        end = self.index["offset"] + self.index["count"].astype(np.uint64) * 8
+        self.index = self.index[:int(np.count_nonzero(end <= len(self._data)))]
+        self._words = self._data[:len(self._data) // 2 * 2].view("<i2")
+
+    def __len__(self):
+        return len(self.index)
+
+    def deltas(self, i):
+        offset, count = int(self.index["offset"][i]), int(self.index["count"][i])
+        return self._words[offset // 2:offset // 2 + 2 * count].reshape(count, 2)
+
+    def times_us(self, i):
+        offset, count = int(self.index["offset"][i]), int(self.index["count"][i])
+        return self._data[offset + 4 * count:offset + 8 * count].view("<u4")
+
+    def line_numbers(self, jsonl_file="mouse_dataset.jsonl"):
+        # 每筆原始紀錄在 JSONL 中的行號 (從 0 起算)；連結的行已不存在或內容不同時為 -1
+        lines = np.full(len(self.index), -1, dtype=np.int64)
+        if not os.path.exists(jsonl_file) or os.path.getsize(jsonl_file) == 0:
+            return lines
+        text = np.memmap(jsonl_file, dtype=np.uint8, mode="r")
+        ends = np.flatnonzero(text == ord("\n")) + 1
+        starts = np.concatenate([[0], ends[:-1]])
+        linked = self.index["line"] != NO_LINE
+        line = np.where(linked, self.index["line"], 0).astype(np.int64)
+        pos = np.searchsorted(starts, line)
+        hit = linked & (pos < len(ends))
+        hit[hit] = starts[pos[hit]] == line[hit]
+        for i in np.flatnonzero(hit):
+            k = pos[i]
+            if zlib.crc32(text[starts[k]:ends[k]]) == self.index["crc"][i]:
+                lines[i] = k
+        return lines
+
+    def points(self, i):
+        return np.cumsum(self.deltas(i), axis=0, dtype=np.int32)
+
+    def load_all(self, indices=None):
+        # 一次解碼多筆：回傳 (points (M, 2) int64, offsets (K+1,))，可直接餵給 interpolate_batch
+        index = self.index if indices is None else self.index[np.asarray(indices)]
+        counts = index["count"].astype(np.int64)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        total = int(offsets[-1])
+        if total == 0:
+            return np.zeros((0, 2), dtype=np.int64), offsets
+        # 第 k 筆第 j 個點的 x 在 _words[offset_k / 2 + 2j]
+        word = np.repeat(index["offset"].astype(np.int64) // 2 - 2 * offsets[:-1], counts) + 2 * np.arange(total)
+        deltas = np.stack([self._words[word], self._words[word + 1]], axis=1).astype(np.int64)
+        # 整段 cumsum 後扣掉前一筆的累積值，每筆的第一個點就回到絕對座標
+        np.cumsum(deltas, axis=0, out=deltas)
+        starts = offsets[:-1]
+        base = np.zeros((len(counts), 2), dtype=np.int64)
+        prev = starts[1:] > 0
+        base[1:][prev] = deltas[starts[1:][prev] - 1]
+        deltas -= np.repeat(base, counts, axis=0)
+        return deltas, offsets
+
+    def resample(self, num=10, indices=None):
+        # 以任意點數重切整個封存檔：回傳 moves (K, 2) 與相對起點的 trajectories (K, num, 2)
+        points, offsets = self.load_all(indices)
+        valid = offsets[1:] > offsets[:-1]
+        start = np.zeros((len(valid), 2))
+        end = np.zeros((len(valid), 2))
+        start[valid] = points[offsets[:-1][valid]]
+        end[valid] = points[offsets[1:][valid] - 1]
+        trajs = interpolate_batch(points, offsets, num=num)
+        trajs[valid] -= start[valid][:, None, :]
+        return end - start, trajs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerate fixed-length trajectories from a raw archive")
+    parser.add_argument("dataset", nargs="?", default="mouse_dataset.jsonl", help="dataset whose .raw archive to read")
+    parser.add_argument("--num", type=int, default=10, help="points per regenerated trajectory")
+    parser.add_argument("-o", "--out", default=None, help="output .npz (moves, trajectories, JSONL line numbers)")
+    args = parser.parse_args()
+    archive = RawArchive(args.dataset)
+    start = time.perf_counter()
+    moves, trajs = archive.resample(args.num)
+    print(f"{len(archive)} trajectories resampled to {args.num} points in {time.perf_counter() - start:.2f}s")
+    lines = archive.line_numbers(args.dataset)
+    if (lines < 0).any():
+        print(f"{int((lines < 0).sum())} trajectories have no matching record in {args.dataset} (line = -1)")
+    out = args.out or os.path.splitext(args.dataset)[0] + f".resampled{args.num}.npz"
+    np.savez(out, moves=moves.astype(np.float32), trajectories=trajs.astype(np.float32), lines=lines)
+    print(f"Saved -> {out}")
@@ -0,0 +1,75 @@
+import numpy as np
+import metrics
+
+# 依軌跡總長度等距切分 (與 Trajectory.interpolate_points 相同的規則)，不依賴 pygame，可離線批次重切
+
+def interpolate_points(points, num=10):
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(pts) < 2:
+        return np.zeros((num, 2))
+
+    seg = pts[1:] - pts[:-1]
+    dists = np.empty(len(pts))
+    dists[0] = 0.0
+    np.cumsum(np.sqrt(seg[:, 0] ** 2 + seg[:, 1] ** 2), out=dists[1:])
+
+    total_dist = dists[-1]
+    if total_dist == 0:
+        return np.zeros((num, 2))
+
+    targets = np.linspace(0, total_dist, num)
+    # 第一個 dists[j+1] >= t 的 j
+    j = np.minimum(np.searchsorted(dists[1:], targets, side="left"), len(pts) - 2)
+    ratio = (targets - dists[j]) / (dists[j + 1] - dists[j] + 1e-8)
+    return pts[j] + ratio[:, None] * (pts[j + 1] - pts[j])
+
+def interpolate_batch(points, offsets, num=10):
+    # points: 所有軌跡串接成 (M, 2)；offsets: (K+1,)，第 k 條軌跡為 points[offsets[k]:offsets[k+1]]
+    # 回傳 (K, num, 2)；點數 < 2 或總長度為 0 的軌跡輸出全 0
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    with metrics.timer("resample.batch"):
+        return _interpolate_batch(pts, offsets, num)
+
+def _interpolate_batch(pts, offsets, num):
+    starts, ends = offsets[:-1], offsets[1:]
+    out = np.zeros((len(starts), num, 2))
+    if len(starts) == 0 or len(pts) < 2:
+        return out
+
+    seg = pts[1:] - pts[:-1]
+    seg_len = np.sqrt(seg[:, 0] ** 2 + seg[:, 1] ** 2)
+    # 軌跡之間的接縫不算長度，讓累積距離在整個 buffer 上保持單調
+    boundary = starts[(starts > 0) & (starts < len(pts))] - 1
+    seg_len[boundary] = 0.0
+    cum = np.empty(len(pts))
+    cum[0] = 0.0
+    np.cumsum(seg_len, out=cum[1:])
+
+    counts = ends - starts
+    valid = counts >= 2
+    valid[valid] = cum[ends[valid] - 1] > cum[starts[valid]]
+    if not valid.any():
+        return out
+
+    s, e = starts[valid], ends[valid]
+    base = cum[s]
+    total = cum[e - 1] - base
+    steps = np.linspace(0.0, 1.0, num)
+    targets = base[:, None] + total[:, None] * steps[None, :]
+
+    j = np.searchsorted(cum[1:], targets, side="left")
+    j = np.clip(j, s[:, None], (e - 2)[:, None])
+    ratio = (targets - cum[j]) / (cum[j + 1] - cum[j] + 1e-8)
+    out[valid] = pts[j] + ratio[..., None] * (pts[j + 1] - pts[j])
+    return out
+
+def to_offsets(trajectories):
+    # list of (n_i, 2) -> (flat points, offsets)，方便餵給 interpolate_batch
+    lengths = np.fromiter((len(t) for t in trajectories), dtype=np.int64, count=len(trajectories))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.zeros((0, 2)), offsets
+    points = np.concatenate([np.asarray(t, dtype=np.float64).reshape(-1, 2) for t in trajectories])
+    return points, offsets
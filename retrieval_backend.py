@@ -0,0 +1,232 @@
+import numpy as np
+
+from dataset_cache import load_arrays
+import metrics
+
+# 最近鄰檢索：不經過 TrajNet，直接從收集到的真實軌跡中找 relative_move 最接近的 k 筆，
+# 依各自的位移做旋轉 / 縮放對齊到查詢位移後加權混合
+# 索引是 (dx, dy) 上的均勻網格：樣本依格子排序 (CSR)，同一欄的連續格子在陣列中也是連續的，
+# 所以查詢半徑 r 只需要 2r+1 段區間，整批查詢都能向量化；結果保證是精確的 k 個最近鄰 (同距離時取排序位置較前者)
+# 查詢點在資料範圍外時，以範圍內最近的點找鄰居，再由 blend 縮放到實際的位移
+
+QUERY_CHUNK = 4096
+
+class GridIndex:
+    def __init__(self, moves, cell_size=None, per_cell=4):
+        moves = np.asarray(moves, dtype=np.float32).reshape(-1, 2)
+        if len(moves) == 0:
+            raise ValueError("cannot build a retrieval index from an empty dataset")
+        with metrics.timer("retrieval.build"):
+            self.bounds = (moves.min(axis=0), moves.max(axis=0))
+            span = np.maximum(self.bounds[1] - self.bounds[0], 1.0)
+            if cell_size is None:
+                # 先以外框估計，再依「每筆樣本所在格子的平均筆數」修正一次；
+                # 資料集中在中央時，外框的平均密度會嚴重低估
+                cell_size = max(1.0, float(np.sqrt(span[0] * span[1] * per_cell / len(moves))))
+                cell_id = self._grid(moves, span, cell_size)
+                occupancy = np.square(np.bincount(cell_id).astype(np.float64)).sum() / len(moves)
+                cell_size = max(1.0, cell_size * float(np.sqrt(per_cell / occupancy)))
+            cell_id = self._grid(moves, span, cell_size)
+            order = np.argsort(cell_id, kind="stable")
+            self.order = order.astype(np.int32 if len(moves) < 2 ** 31 else np.int64)
+            self.moves = np.ascontiguousarray(moves[order])
+            self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+            np.cumsum(np.bincount(cell_id, minlength=self.nx * self.ny), out=self.cell_start[1:])
+
+    def _grid(self, moves, span, cell_size):
+        # 網格原點往外退半格：dx / dy 都是整數，查詢點才會落在格子中央而不是角落，
+        # 第一輪搜尋的邊界距離較大，多數查詢一輪就能確定
+        self.cell = cell_size
+        self.lo = self.bounds[0] - 0.5 * cell_size
+        self.nx, self.ny = (np.floor(span / cell_size + 0.5).astype(np.int64) + 1).tolist()
+        cx, cy = self._cells(moves)
+        return cx * self.ny + cy
+
+    def __len__(self):
+        return len(self.moves)
+
+    def memory_bytes(self):
+        return self.order.nbytes + self.moves.nbytes + self.cell_start.nbytes
+
+    def _cells(self, points):
+        c = np.floor((points - self.lo) / self.cell).astype(np.int64)
+        return np.clip(c[:, 0], 0, self.nx - 1), np.clip(c[:, 1], 0, self.ny - 1)
+
+    def query(self, points, k):
+        # 回傳 (pos, distance)，形狀皆為 (N, k)；pos 是排序後陣列的位置，
+        # 鄰居的位移為 self.moves[pos]，原始資料列號為 self.order[pos]
+        points = np.clip(np.asarray(points, dtype=np.float32).reshape(-1, 2), *self.bounds)
+        k = min(k, len(self.moves))
+        idx = np.empty((len(points), k), dtype=np.int64)
+        dist = np.empty((len(points), k), dtype=np.float32)
+        for s in range(0, len(points), QUERY_CHUNK):
+            chunk = points[s:s + QUERY_CHUNK]
+            todo = np.arange(len(chunk))
+            r = 1
+            while len(todo):
+                done, i, d = self._search(chunk[todo], r, k)
+                idx[s + todo[done]] = i
+                dist[s + todo[done]] = d
+                todo = todo[~done]
+                r *= 2
+        return idx, dist
+
+    def query_one(self, x, y, k):
+        # 單筆查詢：批次版本的固定開銷 (上百次小型 numpy 呼叫) 在這裡佔大部分時間，改用純量運算逐欄取區間
+        k = min(k, len(self.moves))
+        lo_x, lo_y = float(self.lo[0]), float(self.lo[1])
+        x = min(max(x, float(self.bounds[0][0])), float(self.bounds[1][0]))
+        y = min(max(y, float(self.bounds[0][1])), float(self.bounds[1][1]))
+        cx = min(max(int((x - lo_x) // self.cell), 0), self.nx - 1)
+        cy = min(max(int((y - lo_y) // self.cell), 0), self.ny - 1)
+        q = np.array([x, y], dtype=np.float32)
+        r = 1
+        while True:
+            x0, x1 = max(cx - r, 0), min(cx + r, self.nx - 1)
+            y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1)
+            starts = self.cell_start[np.arange(x0, x1 + 1) * self.ny + y0]
+            ends = self.cell_start[np.arange(x0, x1 + 1) * self.ny + y1 + 1]
+            pos = np.concatenate([np.arange(a, b) for a, b in zip(starts.tolist(), ends.tolist())])
+            if len(pos) >= k:
+                diff = self.moves[pos] - q
+                d2 = np.einsum("ij,ij->i", diff, diff)
+                best = np.argsort(d2, kind="stable")[:k]
+                kth = float(np.sqrt(d2[best[-1]]))
+                covered = min(
+                    np.inf if x0 == 0 else x - (lo_x + (cx - r) * self.cell),
+                    np.inf if x1 == self.nx - 1 else lo_x + (cx + r + 1) * self.cell - x,
+                    np.inf if y0 == 0 else y - (lo_y + (cy - r) * self.cell),
+                    np.inf if y1 == self.ny - 1 else lo_y + (cy + r + 1) * self.cell - y)
+                if kth < covered:
+                    return pos[best], np.sqrt(d2[best])
+            r *= 2
+
+    def _search(self, q, r, k):
+        # 在查詢點所在格子周圍 (2r+1)^2 格內找 k 個最近鄰；
+        # 第 k 近的距離小於搜尋範圍的邊界距離才算確定 (範圍外不會有同距離的點)，否則留給下一輪更大的 r
+        m = len(q)
+        cx, cy = self._cells(q)
+        gx = cx[:, None] + np.arange(-r, r + 1)
+        y0 = np.maximum(cy - r, 0)
+        y1 = np.minimum(cy + r, self.ny - 1)
+        valid = (gx >= 0) & (gx < self.nx)
+        gxc = np.clip(gx, 0, self.nx - 1)
+        starts = np.where(valid, self.cell_start[gxc * self.ny + y0[:, None]], 0)
+        ends = np.where(valid, self.cell_start[gxc * self.ny + y1[:, None] + 1], 0)
+
+        lengths = (ends - starts).ravel()
+        offsets = np.cumsum(lengths) - lengths
+        cand = np.arange(lengths.sum()) - np.repeat(offsets - starts.ravel(), lengths)
+        owner = np.repeat(np.arange(m).repeat(2 * r + 1), lengths)
+        diff = self.moves[cand] - q[owner]
+        d2 = np.einsum("ij,ij->i", diff, diff)
+
+        # 以 owner 為主、距離為次的排序；合成一個 float64 key 比 lexsort 快很多
+        # 同一 owner 的候選依排序位置遞增，stable 排序讓同距離時取位置較前者
+        order = np.argsort(owner * (float(d2.max(initial=0.0)) + 1.0) + d2, kind="stable")
+        counts = np.bincount(owner, minlength=m)
+        first = np.cumsum(counts) - counts
+        enough = counts >= k
+        take = first[enough, None] + np.arange(k)
+        picked = order[take]
+
+        # 搜尋範圍的四個邊；碰到整個網格邊界的那一側視為無限遠
+        lo = self.lo + np.stack([cx - r, cy - r], axis=1) * self.cell
+        hi = self.lo + np.stack([cx + r + 1, cy + r + 1], axis=1) * self.cell
+        low = np.where(np.stack([cx - r <= 0, cy - r <= 0], axis=1), np.inf, q - lo)
+        high = np.where(np.stack([cx + r >= self.nx - 1, cy + r >= self.ny - 1], axis=1), np.inf, hi - q)
+        covered = np.minimum(low, high).min(axis=1)
+
+        kth = np.sqrt(d2[picked[:, -1]])
+        done = np.zeros(m, dtype=bool)
+        done[enough] = kth < covered[enough]
+        keep = done[enough]
+        return done, cand[picked[keep]], np.sqrt(d2[picked[keep]])
+
+def blend(queries, moves, trajs, dist):
+    # 每筆鄰居以旋轉 + 縮放 (複數 q / m) 讓其位移對齊到查詢位移，再依距離反比加權平均；
+    # 旋轉係數 (a, b) 先乘上權重，最後只需兩次 einsum
+    qx, qy = queries[:, 0:1], queries[:, 1:2]
+    mx, my = moves[..., 0].astype(np.float64), moves[..., 1].astype(np.float64)
+    norm = mx * mx + my * my
+    small = norm < 1.0
+    inv = 1.0 / np.where(small, 1.0, norm)
+    w = 1.0 / (dist.astype(np.float64) + 1.0)
+    w /= w.sum(axis=1, keepdims=True)
+    wa = w * np.where(small, 1.0, (qx * mx + qy * my) * inv)
+    wb = w * np.where(small, 0.0, (mx * qy - my * qx) * inv)
+    tx, ty = trajs[..., 0], trajs[..., 1]
+    out = np.empty(trajs.shape[:1] + trajs.shape[2:], dtype=np.float32)
+    out[..., 0] = np.einsum("nk,nkt->nt", wa, tx) - np.einsum("nk,nkt->nt", wb, ty)
+    out[..., 1] = np.einsum("nk,nkt->nt", wb, tx) + np.einsum("nk,nkt->nt", wa, ty)
+    # 位移太小的鄰居無法決定方向，只把終點平移到查詢位移
+    if small.any():
+        ws = w * small
+        shift = np.stack([(ws * (qx - mx)).sum(axis=1), (ws * (qy - my)).sum(axis=1)], axis=1)
+        out += shift[:, None, :] * np.linspace(0.0, 1.0, trajs.shape[2])[None, :, None]
+    return out
+
+def blend_one(x, y, moves, trajs, dist):
+    # blend 的單筆版本：k 個鄰居的係數用純量計算，只剩幾次小型矩陣乘法
+    w = 1.0 / (dist.astype(np.float64) + 1.0)
+    w /= w.sum()
+    wa = np.empty(len(w))
+    wb = np.empty(len(w))
+    sx = sy = 0.0
+    for j, ((mx, my), wj) in enumerate(zip(moves.tolist(), w.tolist())):
+        norm = mx * mx + my * my
+        if norm < 1.0:
+            wa[j], wb[j] = wj, 0.0
+            sx += wj * (x - mx)
+            sy += wj * (y - my)
+        else:
+            wa[j] = wj * (x * mx + y * my) / norm
+            wb[j] = wj * (mx * y - my * x) / norm
+    tx, ty = trajs[..., 0], trajs[..., 1]
+    out = np.empty(trajs.shape[1:], dtype=np.float32)
+    out[:, 0] = wa @ tx - wb @ ty
+    out[:, 1] = wb @ tx + wa @ ty
+    if sx or sy:
+        out += np.array([sx, sy]) * np.linspace(0.0, 1.0, len(out))[:, None]
+    return out
+
+class RetrievalTrajNet:
+    # 與 NumpyTrajNet 相同的 predict / predict_batch 介面
+    def __init__(self, jsonl_file="mouse_dataset.jsonl", k=8, cell_size=None, use_cache=True):
+        inputs, targets = load_arrays(jsonl_file, use_cache=use_cache)
+        self._init(inputs, targets, k, cell_size)
+
+    @classmethod
+    def from_arrays(cls, inputs, targets, k=8, cell_size=None):
+        self = cls.__new__(cls)
+        self._init(inputs, targets, k, cell_size)
+        return self
+
+    def _init(self, inputs, targets, k, cell_size):
+        self.k = k
+        self.targets = targets  # 可為 mmap，查詢時只讀取用到的列
+        self.index = GridIndex(inputs, cell_size)
+
+    def memory_bytes(self):
+        return self.index.memory_bytes()
+
+    def predict_batch(self, moves, out=None):
+        q = np.asarray(moves, dtype=np.float32).reshape(-1, 2)
+        if out is None:
+            out = np.empty((len(q), 10, 2), dtype=np.float32)
+        with metrics.timer("retrieval.query"):
+            for s in range(0, len(q), QUERY_CHUNK):
+                chunk = q[s:s + QUERY_CHUNK]
+                idx, dist = self.index.query(chunk, self.k)
+                rows = self.index.order[idx.ravel()]
+                # 依列號排序後再讀，mmap 上是循序存取
+                uniq, inverse = np.unique(rows, return_inverse=True)
+                trajs = np.asarray(self.targets[uniq], dtype=np.float32)[inverse].reshape(idx.shape + (10, 2))
+                out[s:s + len(chunk)] = blend(chunk, self.index.moves[idx], trajs, dist)
+        return out
+
+    def predict(self, dx, dy):
+        x, y = float(dx), float(dy)
+        pos, dist = self.index.query_one(x, y, self.k)
+        trajs = np.asarray(self.targets[self.index.order[pos]], dtype=np.float32).reshape(-1, 10, 2)
+        return blend_one(x, y, self.index.moves[pos], trajs, dist)
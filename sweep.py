@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# 超參數搜尋：grid 或從 grid 隨機抽樣，每組設定跑 k-fold，(設定, 折) 為單位平行丟進 process pool
+# 每個 worker 綁定一份 CPU 核心並設定 torch 執行緒數，資料集是同一份 mmap 的 .npy 快取，
+# 各 worker 只依索引逐 batch 讀取，不會各自複製整份資料
+#   python sweep.py mouse_dataset.jsonl --space "lr=0.001,0.003 batch_size=32,128 hidden=64-128-64,128-256-128 epochs=10"
+#   python sweep.py mouse_dataset.jsonl --space space.json --random 8 --folds 5 --threads-per-worker 2
+#   python sweep.py mouse_dataset.jsonl --space "lr=0.001,0.0003 normalize=0,1"
+
+DEFAULT_SPACE = {"lr": [0.001, 0.003], "batch_size": [32, 128], "hidden": [[64, 128, 64], [128, 256, 128]],
+                 "epochs": [10]}
+
+_DATA = None
+
+# ===================== 搜尋空間 =====================
+def _parse_value(text):
+    # "64-128-64" 是隱藏層寬度；1e-3 這類科學記號不算
+    if "-" in text[1:] and "e-" not in text.lower():
+        return [int(v) for v in text.split("-")]
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+def parse_space(spec):
+    # JSON 檔 / JSON 字串，或 "name=v1,v2 name=v3" 的簡寫 (hidden 寬度以 - 分隔)
+    if spec is None:
+        return dict(DEFAULT_SPACE)
+    if os.path.exists(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if spec.lstrip().startswith("{"):
+        return json.loads(spec)
+    space = {}
+    for item in spec.replace(";", " ").split():
+        name, values = item.split("=", 1)
+        space[name] = [_parse_value(v) for v in values.split(",") if v]
+    return space
+
+def candidates(space, random_n=None, seed=0):
+    names = sorted(space)
+    grid = [dict(zip(names, combo)) for combo in itertools.product(*(space[n] for n in names))]
+    if random_n is not None and random_n < len(grid):
+        pick = np.random.default_rng(seed).choice(len(grid), size=random_n, replace=False)
+        grid = [grid[i] for i in sorted(pick)]
+    return grid
+
+# ===================== worker =====================
+def core_shares(workers, threads_per_worker):
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = list(range(os.cpu_count() or 1))
+    shares = []
+    for i in range(workers):
+        share = cores[(i * threads_per_worker) % len(cores):][:threads_per_worker]
+        shares.append(share or cores[:threads_per_worker])
+    return shares
+
+def _init_worker(shares, jsonl_file):
+    # 每個 worker 從佇列取一份核心；Windows / macOS 沒有 sched_setaffinity，只限制執行緒數
+    global _DATA
+    cores = shares.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(len(cores))
+    from dataset_cache import load_arrays
+    _DATA = load_arrays(jsonl_file)
+
+def _latency_us(model, calls=2000):
+    # 以部署用的純 NumPy 後端量單次呼叫延遲，較能反映各架構在測試頁的實際成本
+    from numpy_backend import NumpyTrajNet, save_npz, weights_from_model
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sweep.npz")
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_npz(weights_from_model(model), path)
+        net = NumpyTrajNet(path)
+    net.predict(1, 1)
+    lat = np.empty(calls)
+    for i in range(calls):
+        t = time.perf_counter()
+        net.predict(i % 300, 50)
+        lat[i] = (time.perf_counter() - t) * 1e6
+    return float(np.percentile(lat, 50))
+
+def run_fold(config, fold, folds, seed=0):
+    import torch
+    import torch.nn as nn
+    from dataset_cache import kfold_indices
+    from train_model import TrajNet, data_stats
+    inputs, targets = _DATA
+    train_idx, val_idx = kfold_indices(len(inputs), folds, fold, seed)
+    torch.manual_seed(seed + fold)
+    model = TrajNet(tuple(config.get("hidden", (64, 128, 64))), bool(config.get("normalize", False)))
+    if model.normalize:
+        # 只用訓練折的統計量，驗證折不外洩
+        model.set_normalization(data_stats(inputs[train_idx], targets[train_idx]))
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.get("lr", 0.001))
+    criterion = nn.MSELoss()
+    batch_size = config.get("batch_size", 32)
+
+    start = time.perf_counter()
+    for epoch in range(config.get("epochs", 10)):
+        perm = np.random.default_rng([seed, fold, epoch]).permutation(train_idx)
+        for i in range(0, len(perm), batch_size):
+            # 排序後讀取，mmap 上較接近循序存取
+            idx = np.sort(perm[i:i + batch_size])
+            x = torch.from_numpy(np.asarray(inputs[idx]))
+            y = torch.from_numpy(np.asarray(targets[idx]))
+            optimizer.zero_grad()
+            loss = criterion(model(x), y)
+            loss.backward()
+            optimizer.step()
+    train_s = time.perf_counter() - start
+
+    with torch.no_grad():
+        pred = model(torch.from_numpy(np.asarray(inputs[val_idx]))).numpy()
+    truth = np.asarray(targets[val_idx])
+    result = {"fold": fold, "train_s": train_s, "val_mse": float(np.mean((pred - truth) ** 2)),
+              "val_px": float(np.linalg.norm((pred - truth).reshape(-1, 10, 2), axis=-1).mean())}
+    if fold == 0:
+        result["latency_us"] = _latency_us(model)
+        result["params"] = sum(p.numel() for p in model.parameters())
+    return result
+
+# ===================== 主流程 =====================
+def summarize(config, folds):
+    val = np.array([f["val_mse"] for f in folds])
+    first = next(f for f in folds if f["fold"] == 0)
+    return {"config": config, "val_mse_mean": float(val.mean()), "val_mse_std": float(val.std()),
+            "val_px_mean": float(np.mean([f["val_px"] for f in folds])),
+            "train_s_mean": float(np.mean([f["train_s"] for f in folds])),
+            "latency_us": first["latency_us"], "params": first["params"], "folds": sorted(folds, key=lambda f: f["fold"])}
+
+def run_sweep(jsonl_file, space=None, random_n=None, folds=5, workers=None, threads_per_worker=1, seed=0,
+              out="sweep_results.json"):
+    from dataset_cache import load_arrays
+    # 先在主行程建好 .npy 快取，worker 只需要 mmap 開啟
+    n = len(load_arrays(jsonl_file)[0])
+    if n < folds:
+        raise ValueError(f"{n} records are not enough for {folds}-fold cross-validation")
+    configs = candidates(parse_space(space) if not isinstance(space, dict) else space, random_n, seed)
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    workers = min(workers, len(configs) * folds)
+    print(f"Sweep: {len(configs)} configs x {folds} folds on {n} records, "
+          f"{workers} workers x {threads_per_worker} threads")
+
+    ctx = multiprocessing.get_context()
+    shares = ctx.Queue()
+    for share in core_shares(workers, threads_per_worker):
+        shares.put(share)
+    results = {i: [] for i in range(len(configs))}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(shares, jsonl_file)) as pool:
+        futures = {pool.submit(run_fold, config, fold, folds, seed): i
+                   for i, config in enumerate(configs) for fold in range(folds)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            results[i].append(fut.result())
+            print(f"[{done}/{len(futures)}] config {i} fold {results[i][-1]['fold']}: "
+                  f"val_mse={results[i][-1]['val_mse']:.4f}")
+
+    board = sorted((summarize(configs[i], f) for i, f in results.items()), key=lambda r: r["val_mse_mean"])
+    report = {"dataset": jsonl_file, "records": n, "folds": folds, "workers": workers,
+              "threads_per_worker": threads_per_worker, "wall_s": time.perf_counter() - start, "leaderboard": board}
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print_leaderboard(report)
+    print(f"Sweep results saved -> {out}")
+    return report
+
+def print_leaderboard(report):
+    print(f"{'rank':>4s} {'val mse (mean±std)':>20s} {'val px':>7s} {'train s':>8s} {'lat us':>7s} {'params':>7s}  config")
+    for rank, r in enumerate(report["leaderboard"], 1):
+        mse = f"{r['val_mse_mean']:.3f}±{r['val_mse_std']:.3f}"
+        print(f"{rank:4d} {mse:>20s} {r['val_px_mean']:7.2f} {r['train_s_mean']:8.1f} "
+              f"{r['latency_us']:7.1f} {r['params']:7d}  {json.dumps(r['config'])}")
+    print(f"{len(report['leaderboard'])} configs in {report['wall_s']:.1f}s")
+    best = report["leaderboard"][0]["config"]
+    args = [f"--{name.replace('_', '-')} {','.join(map(str, v)) if isinstance(v, list) else v}"
+            for name, v in sorted(best.items()) if name != "normalize"]
+    if best.get("normalize"):
+        args.append("--normalize")
+    print(f"Best: python train_model.py {report['dataset']} {' '.join(args)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with k-fold cross-validation")
+    parser.add_argument("dataset", nargs="?", default="mouse_dataset.jsonl")
+    parser.add_argument("--space", default=None, help='JSON file/string or "lr=0.001,0.003 hidden=64-128-64"')
+    parser.add_argument("--random", type=int, default=None, help="sample N configs from the grid")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="sweep_results.json")
+    args = parser.parse_args(argv)
+    run_sweep(args.dataset, args.space, args.random, args.folds, args.workers, args.threads_per_worker,
+              args.seed, args.out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,252 @@
+import os
+import queue
+import threading
+import time
+import weakref
 import onnxruntime as ort
 import numpy as np
+import metrics
+import prediction_cache
+from export_variants import recommended_path
 
-def run_inference(model_path="mouse_traj.onnx", dx=100, dy=50):
-    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
-    input_data = np.array([[dx, dy]], dtype=np.float32)
-    outputs = session.run(None, {"input": input_data})
-    traj = outputs[0].reshape(10, 2)
-    return traj
+def _run_session(sessions, inputs):
+    session = sessions.get()
+    try:
+        with metrics.timer("inference.session_run"):
+            outputs = session.run(None, {"input": inputs})
+    finally:
+        sessions.put(session)
+    return outputs[0].reshape(-1, 10, 2)
+
+def _batch_loop(requests, sessions, max_batch, max_wait):
+    # 背景執行緒不持有 InferenceEngine，引擎沒有人引用時 finalizer 送出 None 讓它結束
+    while True:
+        first = requests.get()
+        if first is None:
+            return
+        pending = [first]
+        stop_at = time.perf_counter() + max_wait
+        while len(pending) < max_batch:
+            remaining = stop_at - time.perf_counter()
+            try:
+                item = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                requests.put(None)
+                break
+            pending.append(item)
+
+        inputs = np.array([slot["move"] for slot in pending], dtype=np.float32)
+        try:
+            trajs = _run_session(sessions, inputs)
+            for slot, traj in zip(pending, trajs):
+                slot["result"] = traj
+        except Exception as e:
+            for slot in pending:
+                slot["error"] = e
+        for slot in pending:
+            slot["done"].set()
+
+class InferenceEngine:
+    # 長駐推理引擎：模型只載入一次，多執行緒共用 session，並把併發的單筆請求合併成一次 batch
+    # use_variant: 載入 <name>.variants.json 推薦的最佳化 / INT8 版本 (沒有或不符時用原本的模型)
+    def __init__(self, model_path="mouse_traj.onnx", pool_size=2, max_batch=256, max_wait_ms=0.0,
+                 intra_op_threads=1, use_variant=True):
+        self.model_path = model_path
+        self.session_path = recommended_path(model_path) if use_variant else model_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = intra_op_threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._sessions = queue.Queue()
+        for _ in range(max(1, pool_size)):
+            with metrics.timer("inference.session_create"):
+                self._sessions.put(ort.InferenceSession(self.session_path, opts, providers=["CPUExecutionProvider"]))
+
+        self._requests = queue.Queue()
+        self._closed = False
+        # 「檢查已關閉 + 放入請求」與 close 放入結束標記互斥，標記之後不會再有請求，排在前面的都會被處理
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=_batch_loop, daemon=True,
+                                        args=(self._requests, self._sessions, max_batch, self.max_wait))
+        self._worker.start()
+        self._stop = weakref.finalize(self, self._requests.put, None)
+
+    def predict_batch(self, moves):
+        inputs = np.ascontiguousarray(moves, dtype=np.float32).reshape(-1, 2)
+        if len(inputs) == 0:
+            return np.zeros((0, 10, 2), dtype=np.float32)
+        return _run_session(self._sessions, inputs)
+
+    def predict(self, dx, dy):
+        done = threading.Event()
+        slot = {"move": (dx, dy), "done": done}
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferenceEngine is closed")
+            self._requests.put(slot)
+        done.wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["result"]
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._stop()
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BoundInference:
+    # 穩定狀態不配置記憶體的推理：輸入 / 輸出緩衝區依 max_batch 預先配置，透過 IO binding 直接讀寫，
+    # 結果複製到呼叫端提供的陣列。每個 batch 大小的綁定只建立一次；非執行緒安全，每個執行緒各用一個
+    def __init__(self, model_path="mouse_traj.onnx", max_batch=1024, intra_op_threads=1, use_variant=True):
+        self.model_path = model_path
+        self.session_path = recommended_path(model_path) if use_variant else model_path
+        self.max_batch = max_batch
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = intra_op_threads
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        with metrics.timer("inference.session_create"):
+            self.session = ort.InferenceSession(self.session_path, opts, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+        self._output_name = self.session.get_outputs()[0].name
+        self._inputs = np.zeros((max_batch, 2), dtype=np.float32)
+        self._outputs = np.zeros((max_batch, 10, 2), dtype=np.float32)
+        self._bindings = {}
+
+    def _binding(self, n):
+        binding = self._bindings.get(n)
+        if binding is None:
+            # 前 n 列在連續緩衝區中的起始位址不變，只有形狀不同
+            binding = self.session.io_binding()
+            binding.bind_input(self._input_name, "cpu", 0, np.float32, [n, 2], self._inputs.ctypes.data)
+            binding.bind_output(self._output_name, "cpu", 0, np.float32, [n, 20], self._outputs.ctypes.data)
+            self._bindings[n] = binding
+        return binding
+
+    def predict_into(self, moves, out):
+        # moves: (n, 2)，out: (n, 10, 2) float32；回傳 out
+        n = len(moves)
+        if n > self.max_batch:
+            raise ValueError(f"batch of {n} exceeds max_batch={self.max_batch}")
+        np.copyto(self._inputs[:n], moves, casting="unsafe")
+        self.session.run_with_iobinding(self._binding(n))
+        np.copyto(out, self._outputs[:n])
+        return out
+
+    def predict(self, dx, dy, out=None):
+        # out 為 None 時回傳內部緩衝區的 view，下次呼叫會被覆寫
+        self._inputs[0, 0] = dx
+        self._inputs[0, 1] = dy
+        self.session.run_with_iobinding(self._binding(1))
+        if out is None:
+            return self._outputs[0]
+        np.copyto(out, self._outputs[0])
+        return out
+
+_engines = {}
+_engines_lock = threading.Lock()
+_bound = threading.local()
+RELOAD_CHECK_S = 0.5  # 模型檔是否更新 (stat) 最多每隔這麼久檢查一次，熱路徑上的呼叫不必每次都 stat
+_model_keys = {}      # 呼叫端傳入的路徑字串 -> ((絕對路徑, mtime), 下次檢查的時間)
+
+def _model_key(model_path):
+    now = time.perf_counter()
+    entry = _model_keys.get(model_path)
+    if entry is not None and now < entry[1]:
+        return entry[0]
+    key = (os.path.abspath(model_path), os.path.getmtime(model_path))
+    _model_keys[model_path] = (key, now + RELOAD_CHECK_S)
+    return key
+
+def get_engine(model_path="mouse_traj.onnx", **kwargs):
+    # 以檔案修改時間作為 key，重新訓練後會自動換成新模型；舊引擎只從表中移除，
+    # 其他執行緒手上的參考仍可繼續使用，最後一個參考消失時背景執行緒才結束
+    key = _model_key(model_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            for old_key in [k for k in _engines if k[0] == key[0]]:
+                del _engines[old_key]
+            engine = InferenceEngine(model_path, **kwargs)
+            _engines[key] = engine
+    return engine
+
+_caches = {}
+
+def get_cache(model_path="mouse_traj.onnx"):
+    # 與 get_engine 相同，模型檔更新後換一份新的快取 (網格會重新檢查模型雜湊)；
+    # 命中時的查表本身只要幾微秒，所以同樣不是每次都 stat
+    key = _model_key(model_path)
+    cache = _caches.get(key)
+    if cache is None:
+        engine = get_engine(model_path)
+        with _engines_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                for old_key in [k for k in _caches if k[0] == key[0]]:
+                    del _caches[old_key]
+                cache = _caches[key] = prediction_cache.PredictionCache(model_path, engine)
+    return cache
+
+def release(model_path="mouse_traj.onnx"):
+    # 關閉並移除某個模型路徑的引擎與預測快取 (網格的 mmap 隨快取一起釋放)，例如測試頁切換到別的模型版本時
+    path = os.path.abspath(model_path)
+    with _engines_lock:
+        engines = [_engines.pop(k) for k in [k for k in _engines if k[0] == path]]
+        for key in [k for k in _caches if k[0] == path]:
+            del _caches[key]
+    for engine in engines:
+        engine.close()
+
+def build_prediction_grid(model_path="mouse_traj.onnx", half_w=prediction_cache.GRID_HALF_W,
+                          half_h=prediction_cache.GRID_HALF_H):
+    # 建網格時用多執行緒的 session 跑大 batch；網格以 fp32 模型為準
+    with InferenceEngine(model_path, pool_size=1, intra_op_threads=0, use_variant=False) as engine:
+        path = prediction_cache.build_grid(model_path, engine.predict_batch, half_w, half_h)
+    with _engines_lock:
+        for key in [k for k in _caches if k[0] == os.path.abspath(model_path)]:
+            del _caches[key]
+    return path
+
+def get_bound_engine(model_path="mouse_traj.onnx", max_batch=1024):
+    # 每個執行緒一個 BoundInference，同樣以修改時間判斷是否要重新載入 (最多每 RELOAD_CHECK_S 秒 stat 一次)；
+    # 最在意延遲的呼叫端可以取得一次後自己保留，直接呼叫 predict
+    key = _model_key(model_path)
+    cache = getattr(_bound, "engines", None)
+    if cache is None:
+        cache = _bound.engines = {}
+    by_batch = cache.get(key)
+    if by_batch is None:
+        for old_key in [k for k in cache if k[0] == key[0]]:
+            del cache[old_key]
+        by_batch = cache[key] = {}
+    engine = by_batch.get(max_batch)
+    if engine is None:
+        engine = by_batch[max_batch] = BoundInference(model_path, max_batch)
+    return engine
+
+def run_inference(model_path="mouse_traj.onnx", dx=100, dy=50, out=None):
+    # 傳入 out ((10, 2) float32) 時走 IO binding 路徑，結果直接寫入 out
+    # 否則先查預測快取，回傳的陣列為唯讀
+    if out is not None:
+        return get_bound_engine(model_path).predict(dx, dy, out)
+    return get_cache(model_path).predict(dx, dy)
+
+def run_inference_batch(model_path="mouse_traj.onnx", moves=None):
+    return get_engine(model_path).predict_batch(moves)
 
 if __name__ == "__main__":
     test = run_inference("mouse_traj.onnx", dx=120, dy=80)
-    print(test)
\ No newline at end of file
+    print(test)
@@ -1,75 +1,546 @@
-import json
+import copy
+import os
+import time
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Subset, get_worker_info
 import numpy as np
+from dataset_cache import (load_arrays, iter_line_chunks, parse_lines, parse_jsonl, complete_size, tail_digest,
+                           split_indices, is_shard_dir, shard_files, load_shard, source_file, CHUNK_ROWS)
+from numpy_backend import export_npz
+import artifact_cache
+import metrics
+
+REPLAY_SIZE = 20000  # checkpoint 中保留的舊資料樣本數，增量訓練時與新資料混合
 
 class MouseDataset(Dataset):
-    def __init__(self, jsonl_file):
-        self.samples = []
-        with open(jsonl_file, "r", encoding="utf-8") as f:
-            for line in f:
-                record = json.loads(line)
-                dx = record["relative_move"]["dx"]
-                dy = record["relative_move"]["dy"]
-                traj = record["trajectory"]  # list [x,y], len=10
-                traj = np.array(traj, dtype=np.float32).flatten()  # 10*2=20
-                self.samples.append(((dx, dy), traj))
+    def __init__(self, jsonl_file, use_cache=True):
+        # inputs: (N, 2), targets: (N, 20)，預設由 mmap 的 .npy 快取讀取
+        self.inputs, self.targets = load_arrays(jsonl_file, use_cache=use_cache)
 
     def __len__(self):
-        return len(self.samples)
+        return len(self.inputs)
 
     def __getitem__(self, idx):
-        (dx, dy), traj = self.samples[idx]
-        x = np.array([dx, dy], dtype=np.float32)
-        y = traj
+        x = np.array(self.inputs[idx])
+        y = np.array(self.targets[idx])
         return x, y
 
+class StreamingMouseDataset(IterableDataset):
+    # 串流讀取一個或多個 JSONL (可為 .gz) 或壓縮分片目錄，依位元組範圍 / 分片切給各個 DataLoader worker，
+    # 分塊解析並透過固定大小的 shuffle buffer 打散，記憶體用量與資料集大小無關
+    def __init__(self, jsonl_files, shuffle_buffer=65536, chunk_lines=8192, seed=None):
+        if isinstance(jsonl_files, str):
+            jsonl_files = [jsonl_files]
+        self.jsonl_files = list(jsonl_files)
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_lines = chunk_lines
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _shards(self, worker_id, num_workers):
+        for i, path in enumerate(self.jsonl_files):
+            if is_shard_dir(path):
+                for j, shard in enumerate(shard_files(path)):
+                    if j % num_workers == worker_id:
+                        yield shard, 0, None
+                continue
+            if path.endswith(".gz"):
+                if i % num_workers == worker_id:
+                    yield path, 0, None
+                continue
+            size = os.path.getsize(path)
+            step = -(-size // num_workers)
+            start = worker_id * step
+            if start < size:
+                yield path, start, min(size, start + step)
+
+    def _chunks(self, worker_id, num_workers):
+        for path, start, end in self._shards(worker_id, num_workers):
+            if isinstance(path, tuple):
+                yield load_shard(*path)
+                continue
+            for lines in iter_line_chunks(path, start, end, self.chunk_lines):
+                with metrics.timer("dataset.parse_chunk"):
+                    chunk = parse_lines(lines)
+                yield chunk
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        seed = self.seed if self.seed is not None else torch.initial_seed()
+        rng = np.random.default_rng([seed % (2 ** 32), self.epoch, worker_id])
+
+        buf_x = np.zeros((0, 2), dtype=np.float32)
+        buf_y = np.zeros((0, 20), dtype=np.float32)
+        for x, y in self._chunks(worker_id, num_workers):
+            if self.shuffle_buffer <= 0:
+                yield from zip(x, y)
+                continue
+            buf_x = np.concatenate([buf_x, x])
+            buf_y = np.concatenate([buf_y, y])
+            overflow = len(buf_x) - self.shuffle_buffer
+            if overflow > 0:
+                perm = rng.permutation(len(buf_x))
+                out, keep = perm[:overflow], perm[overflow:]
+                yield from zip(buf_x[out], buf_y[out])
+                buf_x, buf_y = buf_x[keep], buf_y[keep]
+        perm = rng.permutation(len(buf_x))
+        yield from zip(buf_x[perm], buf_y[perm])
+
+DEFAULT_HIDDEN = (64, 128, 64)
+
 class TrajNet(nn.Module):
-    def __init__(self):
+    def __init__(self, hidden=DEFAULT_HIDDEN, normalize=False):
+        # hidden: 各隱藏層寬度；預設結構與參數名稱 (net.0 / net.2 / ...) 與原本相同
+        # normalize: 輸入減平均除以標準差、輸出乘回標準差加平均，網路本身只學正規化後的數值；
+        # 統計量存成 buffer (隨 state_dict 保存)，匯出前以 folded() 併入第一層與最後一層
         super().__init__()
-        self.net = nn.Sequential(
-            nn.Linear(2, 64),
-            nn.ReLU(),
-            nn.Linear(64, 128),
-            nn.ReLU(),
-            nn.Linear(128, 64),
-            nn.ReLU(),
-            nn.Linear(64, 20)
-        )
+        self.hidden = tuple(hidden)
+        self.normalize = normalize
+        layers = []
+        width = 2
+        for h in hidden:
+            layers += [nn.Linear(width, h), nn.ReLU()]
+            width = h
+        layers.append(nn.Linear(width, 20))
+        self.net = nn.Sequential(*layers)
+        if normalize:
+            self.register_buffer("in_mean", torch.zeros(2))
+            self.register_buffer("in_scale", torch.ones(2))
+            self.register_buffer("out_mean", torch.zeros(20))
+            self.register_buffer("out_scale", torch.ones(20))
 
     def forward(self, x):
-        return self.net(x)
+        if not self.normalize:
+            return self.net(x)
+        return self.net((x - self.in_mean) / self.in_scale) * self.out_scale + self.out_mean
+
+    def set_normalization(self, stats, min_scale=1.0):
+        # stats: data_stats() 的結果；標準差小於 min_scale 像素的維度 (例如恆為 0 的起點) 不放大
+        n = max(stats["count"], 1)
+        for prefix, key in (("in", "input"), ("out", "target")):
+            std = (stats[key + "_m2"] / n).sqrt()
+            getattr(self, prefix + "_mean").copy_(stats[key + "_mean"].float())
+            getattr(self, prefix + "_scale").copy_(torch.clamp(std, min=min_scale).float())
+
+    def folded(self):
+        # 回傳把正規化併入權重、可直接吃原始 (dx, dy) 的等價模型，匯出的圖仍只有 Gemm / Relu
+        if not self.normalize:
+            return self
+        model = TrajNet(self.hidden)
+        model.load_state_dict({k: v for k, v in self.state_dict().items() if k.startswith("net.")})
+        linears = [m for m in model.net if isinstance(m, nn.Linear)]
+        with torch.no_grad():
+            first, last = linears[0], linears[-1]
+            first.bias -= first.weight @ (self.in_mean / self.in_scale)
+            first.weight /= self.in_scale
+            last.weight *= self.out_scale[:, None]
+            last.bias.mul_(self.out_scale).add_(self.out_mean)
+        return model
+
+def tensor_batches(inputs, targets, batch_size):
+    # 整份資料常駐為 tensor，每個 epoch 只做一次 randperm，再依索引切 batch
+    perm = torch.randperm(len(inputs))
+    for i in range(0, len(perm), batch_size):
+        idx = perm[i:i + batch_size]
+        yield inputs[idx], targets[idx]
+
+def checkpoint_path(save_path):
+    return os.path.splitext(save_path)[0] + ".ckpt.pt"
+
+def _chunk_stats(inputs, targets):
+    stats = {"count": len(inputs)}
+    for name, arr in (("input", inputs), ("target", targets)):
+        a = torch.from_numpy(np.asarray(arr, dtype=np.float64))
+        mean = a.mean(0) if len(a) else torch.zeros(a.shape[1], dtype=torch.float64)
+        stats[name + "_mean"] = mean
+        stats[name + "_m2"] = ((a - mean) ** 2).sum(0)
+    return stats
+
+def data_stats(inputs, targets, chunk_rows=CHUNK_ROWS, indices=None):
+    # 可合併的統計量 (筆數、平均、平方差總和)，供輸入 / 輸出正規化使用
+    # 分塊掃過一次 (mmap 不會整份載入)，以 merge_stats 合併；indices 指定時只統計這些列 (例如訓練集)
+    n = len(inputs) if indices is None else len(indices)
+    rows = lambda i: slice(i, i + chunk_rows) if indices is None else indices[i:i + chunk_rows]
+    stats = _chunk_stats(inputs[rows(0)], targets[rows(0)])
+    for i in range(chunk_rows, n, chunk_rows):
+        stats = merge_stats(stats, _chunk_stats(inputs[rows(i)], targets[rows(i)]))
+    return stats
+
+def stream_stats(dataset):
+    # 串流模式沒有整份陣列，另外掃一次所有檔案
+    stats = None
+    for x, y in dataset._chunks(0, 1):
+        chunk = data_stats(x, y)
+        stats = chunk if stats is None else merge_stats(stats, chunk)
+    return stats if stats is not None else data_stats(np.zeros((0, 2)), np.zeros((0, 20)))
+
+def merge_stats(a, b):
+    # Chan 等人的平行合併公式，不需要重新讀取舊資料
+    n = a["count"] + b["count"]
+    if b["count"] == 0:
+        return a
+    out = {"count": n}
+    for name in ("input", "target"):
+        delta = b[name + "_mean"] - a[name + "_mean"]
+        out[name + "_mean"] = a[name + "_mean"] + delta * b["count"] / n
+        out[name + "_m2"] = a[name + "_m2"] + b[name + "_m2"] + delta ** 2 * a["count"] * b["count"] / n
+    return out
+
+def sample_replay(inputs, targets, size=REPLAY_SIZE, seed=0):
+    idx = np.sort(np.random.default_rng(seed).permutation(len(inputs))[:size])
+    return torch.from_numpy(np.array(inputs[idx])), torch.from_numpy(np.array(targets[idx]))
 
-def train_model(jsonl_file, save_path="mouse_traj.onnx", epochs=50, batch_size=32, lr=0.001):
-    dataset = MouseDataset(jsonl_file)
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+def update_replay(replay_x, replay_y, seen, new_x, new_y, size=REPLAY_SIZE, seed=None):
+    # reservoir sampling：到目前為止看過的每筆紀錄留在緩衝區的機率都相同
+    fill = max(0, min(size - len(replay_x), len(new_x)))
+    replay_x = torch.cat([replay_x, new_x[:fill]])
+    replay_y = torch.cat([replay_y, new_y[:fill]])
+    rest = np.arange(fill, len(new_x))
+    if len(rest):
+        slots = np.random.default_rng(seed).integers(0, seen + rest + 1)
+        keep = slots < size
+        slots, items = slots[keep], rest[keep]
+        # 同一個位置被多筆寫入時以最後一筆為準，與逐筆處理的結果相同
+        _, last = np.unique(slots[::-1], return_index=True)
+        last = len(slots) - 1 - last
+        slots, items = torch.from_numpy(slots[last]), torch.from_numpy(items[last])
+        replay_x[slots] = new_x[items]
+        replay_y[slots] = new_y[items]
+    return replay_x, replay_y
 
-    model = TrajNet()
+def make_watermark(jsonl_file, offset):
+    return {"path": os.path.abspath(jsonl_file), "offset": offset, "tail": tail_digest(jsonl_file, offset)}
+
+def read_new_records(jsonl_file, watermark):
+    # watermark 之後新增的 (inputs, targets, 新的 offset)；watermark 之前的內容被改寫過 (例如復原) 時回傳 None
+    if not watermark or not os.path.isfile(jsonl_file):
+        return None
+    offset = watermark["offset"]
+    end = complete_size(jsonl_file)
+    if end < offset or tail_digest(jsonl_file, offset) != watermark["tail"]:
+        return None
+    inputs, targets = parse_jsonl(jsonl_file, offset, end)
+    return inputs, targets, end
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return torch.load(path, map_location="cpu")
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {type(e).__name__}: {e}")
+        return None
+
+def prepare_incremental(jsonl_file, ckpt_path, hidden=DEFAULT_HIDDEN, normalize=False):
+    # 回傳 (checkpoint, (new_inputs, new_targets, end))；不適合增量訓練時回傳 (None, None) 並改為完整重訓
+    ckpt = load_checkpoint(ckpt_path)
+    if ckpt is None:
+        print("No checkpoint found, running a full training")
+        return None, None
+    if list(ckpt.get("hidden", DEFAULT_HIDDEN)) != list(hidden) or ckpt.get("normalize", False) != normalize:
+        print("Checkpoint has a different architecture, running a full training")
+        return None, None
+    if is_shard_dir(jsonl_file):
+        print("Incremental training needs an append-only JSONL dataset, running a full training")
+        return None, None
+    new = read_new_records(jsonl_file, ckpt.get("watermark"))
+    if new is None:
+        print("Dataset changed before the last watermark, running a full training")
+        return None, None
+    if len(new[0]) > ckpt["stats"]["count"]:
+        print(f"{len(new[0])} new records outnumber the {ckpt['stats']['count']} trained ones, running a full training")
+        return None, None
+    return ckpt, new
+
+def run_state_path(save_path):
+    return os.path.splitext(save_path)[0] + ".run.pt"
+
+def run_signature(jsonl_file, **config):
+    # 資料檔或設定不同時，不從上次中斷的進度接續
+    files = [jsonl_file] if isinstance(jsonl_file, str) else list(jsonl_file)
+    return {"files": [[os.path.abspath(f), os.path.getsize(source_file(f))] for f in files], **config}
+
+def evaluate(model, criterion, inputs, targets, batch_size=65536):
+    total = 0.0
+    model.eval()
+    with torch.no_grad():
+        for i in range(0, len(inputs), batch_size):
+            x, y = inputs[i:i + batch_size], targets[i:i + batch_size]
+            total += criterion(model(x), y).item() * len(x)
+    model.train()
+    return total / max(len(inputs), 1)
+
+def train_model(jsonl_file, save_path="mouse_traj.onnx", epochs=50, batch_size=32, lr=0.001,
+                fast=True, num_threads=None, streaming=False, num_workers=0, progress=None, cancel=None,
+                variants=True, grid=True, incremental=False, incremental_epochs=10, replay_ratio=1.0,
+                val_frac=0.1, patience=5, min_delta=1e-3, resume=True, hidden=DEFAULT_HIDDEN, normalize=False,
+                cache=True):
+    # progress: 每個 epoch 以 dict 回報進度的 callable；cancel: 具 is_set() 的物件，設定後中止訓練且不匯出
+    # incremental: 從 <save_path>.ckpt.pt 接續，只用 watermark 之後新增的紀錄加上等量的舊資料樣本微調
+    # 以固定種子切出 val_frac 的驗證集；驗證 loss 連續 patience 個 epoch 沒有改善超過 min_delta (相對值)
+    # 就提前停止，匯出前換回驗證 loss 最低的權重。每個 epoch 結束時把進度存到 <save_path>.run.pt，
+    # resume=True 時中斷 (取消、當機、關閉視窗) 後再次訓練會從該處接續 (串流模式沒有驗證集)
+    # normalize: 以整份資料的平均 / 標準差正規化輸入與輸出，匯出時併入 ONNX，呼叫端仍傳原始 (dx, dy)；
+    # ReLU + Adam 對整體尺度本來就不太敏感，實測未必更快收斂，預設關閉 (benchmark.py --normalization 可比較)
+    # cache: 資料內容、超參數與網路結構都和 model_cache/ 中某個版本相同時直接還原該版本，不重新訓練
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    artifacts = cache_key = None
+    if cache:
+        artifacts = artifact_cache.ArtifactCache(artifact_cache.cache_dir_for(save_path))
+        cache_key = artifact_cache.cache_key(jsonl_file, save_path, {
+            "epochs": epochs, "batch_size": batch_size, "lr": lr, "fast": fast, "streaming": streaming,
+            "incremental": incremental, "incremental_epochs": incremental_epochs, "replay_ratio": replay_ratio,
+            "val_frac": val_frac, "patience": patience, "min_delta": min_delta, "hidden": list(hidden),
+            "normalize": normalize, "variants": variants, "grid": grid})
+        meta = artifacts.restore(cache_key, save_path)
+        if meta is not None:
+            print(f"Dataset and settings unchanged, restored cached model {cache_key[:12]} -> {save_path}")
+            if progress is not None:
+                progress({"type": "stage", "stage": "cached"})
+            return save_path
+
+    ckpt_path = checkpoint_path(save_path)
+    ckpt = None
+    if incremental and not streaming:
+        ckpt, new = prepare_incremental(jsonl_file, ckpt_path, hidden, normalize)
+        if ckpt is not None and len(new[0]) == 0:
+            print("No new records since the last training, model is up to date")
+            return save_path
+
+    val_x = val_y = None
+    stats = norm_stats = None
+    if ckpt is not None:
+        new_x, new_y, offset = torch.from_numpy(new[0]), torch.from_numpy(new[1]), new[2]
+        replay_x, replay_y = ckpt["replay_inputs"], ckpt["replay_targets"]
+        pick = torch.randperm(len(replay_x))[:int(len(new_x) * replay_ratio)]
+        inputs = torch.cat([new_x, replay_x[pick]])
+        targets = torch.cat([new_y, replay_y[pick]])
+        train_idx, val_idx = split_indices(len(inputs), val_frac)
+        val_x, val_y = inputs[val_idx], targets[val_idx]
+        inputs, targets = inputs[train_idx], targets[train_idx]
+        batches = lambda: tensor_batches(inputs, targets, batch_size)
+        epochs = incremental_epochs
+        print(f"Incremental training: {len(new_x)} new + {len(pick)} replayed records, {epochs} epochs")
+    elif streaming:
+        # jsonl_file 可為多個檔案 (含 .gz)，不需整份載入記憶體
+        dataset = StreamingMouseDataset(jsonl_file)
+        dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+        batches = lambda: dataloader
+        if normalize:
+            stats = norm_stats = stream_stats(dataset)
+    else:
+        # 分片目錄沒有位元組位移可言，不記 watermark，之後的增量訓練會改為完整重訓
+        offset = None if is_shard_dir(jsonl_file) else complete_size(jsonl_file)
+        dataset = MouseDataset(jsonl_file)
+        # checkpoint 存整份資料的統計 (之後增量訓練再合併)；正規化只用訓練集的，驗證集不外洩，與 sweep.py 相同
+        stats = data_stats(dataset.inputs, dataset.targets)
+        train_idx, val_idx = split_indices(len(dataset), val_frac)
+        if normalize:
+            norm_stats = data_stats(dataset.inputs, dataset.targets, indices=train_idx)
+        val_x = torch.from_numpy(np.array(dataset.inputs[val_idx]))
+        val_y = torch.from_numpy(np.array(dataset.targets[val_idx]))
+        if fast:
+            inputs = torch.from_numpy(np.array(dataset.inputs[train_idx]))
+            targets = torch.from_numpy(np.array(dataset.targets[train_idx]))
+            batches = lambda: tensor_batches(inputs, targets, batch_size)
+        else:
+            dataloader = DataLoader(Subset(dataset, train_idx.tolist()), batch_size=batch_size, shuffle=True)
+            batches = lambda: dataloader
+    if val_x is not None and len(val_x) == 0:
+        val_x = val_y = None
+
+    model = TrajNet(hidden, normalize)
+    if normalize and norm_stats is not None:
+        # 增量訓練沿用 checkpoint 裡的正規化 (在 state_dict 中)，不然同一組權重的意義會改變
+        model.set_normalization(norm_stats)
     criterion = nn.MSELoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    if ckpt is not None:
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+
+    run_path = run_state_path(save_path)
+    signature = run_signature(jsonl_file, epochs=epochs, batch_size=batch_size, lr=lr, val_frac=val_frac,
+                              streaming=streaming, fast=fast, hidden=list(hidden), normalize=normalize)
+    start_epoch = 0
+    best_loss, best_epoch, best_state, bad_epochs = float("inf"), 0, None, 0
+    best_optimizer = None  # 與 best_state 同一個 epoch 的 Adam 狀態，存進 checkpoint 時兩者要一致
+    # 增量訓練很短，不需要接續
+    if resume and ckpt is None:
+        state = load_checkpoint(run_path)
+        if state is not None and state.get("signature") == signature:
+            model.load_state_dict(state["model"])
+            optimizer.load_state_dict(state["optimizer"])
+            torch.set_rng_state(state["rng"])
+            start_epoch = state["epoch"]
+            best_loss, best_epoch, best_state, bad_epochs = (state["best_loss"], state["best_epoch"],
+                                                             state["best_state"], state["bad_epochs"])
+            best_optimizer = state.get("best_optimizer")
+            print(f"Resuming from epoch {start_epoch}/{epochs}")
 
-    for epoch in range(epochs):
+    train_start = time.perf_counter()
+    epoch_times = []
+    stopped = None
+    for epoch in range(start_epoch, epochs):
+        if patience and val_x is not None and bad_epochs >= patience:
+            stopped = epoch
+            break
         total_loss = 0
-        for x, y in dataloader:
+        seen = 0
+        start = time.perf_counter()
+        if streaming:
+            dataset.set_epoch(epoch)
+        for x, y in batches():
+            if cancel is not None and cancel.is_set():
+                break
             optimizer.zero_grad()
             pred = model(x)
             loss = criterion(pred, y)
             loss.backward()
             optimizer.step()
             total_loss += loss.item() * x.size(0)
+            seen += x.size(0)
 
-        avg_loss = total_loss / len(dataset)
-        print(f"Epoch {epoch+1}/{epochs}, Loss={avg_loss:.4f}")
+        if cancel is not None and cancel.is_set():
+            print(f"Training cancelled at epoch {epoch+1}/{epochs}")
+            if resume and ckpt is None and os.path.exists(run_path):
+                print(f"Progress kept in {run_path}, training again will resume")
+            return None
 
+        avg_loss = total_loss / max(seen, 1)
+        line = f"Epoch {epoch+1}/{epochs}, Loss={avg_loss:.4f}"
+        val_loss = None
+        if val_x is not None:
+            val_loss = evaluate(model, criterion, val_x, val_y)
+            line += f", Val={val_loss:.4f}"
+            if val_loss < best_loss * (1 - min_delta):
+                best_loss, best_epoch, bad_epochs = val_loss, epoch + 1, 0
+                best_state = {k: v.clone() for k, v in model.state_dict().items()}
+                best_optimizer = copy.deepcopy(optimizer.state_dict())
+            else:
+                bad_epochs += 1
+        elapsed = time.perf_counter() - start
+        epoch_times.append(elapsed)
+        metrics.record("train.epoch", elapsed, start)
+        samples_per_s = seen / max(elapsed, 1e-9)
+        print(f"{line}, {samples_per_s:.0f} samples/s")
+        if progress is not None:
+            eta = (time.perf_counter() - train_start) / len(epoch_times) * (epochs - epoch - 1)
+            progress({"type": "epoch", "epoch": epoch + 1, "epochs": epochs, "loss": avg_loss,
+                      "val_loss": val_loss, "samples_per_s": samples_per_s, "eta": eta, "epoch_s": elapsed})
+        if resume and ckpt is None:
+            save_checkpoint(run_path, {"signature": signature, "epoch": epoch + 1, "model": model.state_dict(),
+                                       "optimizer": optimizer.state_dict(), "rng": torch.get_rng_state(),
+                                       "best_loss": best_loss, "best_epoch": best_epoch,
+                                       "best_state": best_state, "best_optimizer": best_optimizer,
+                                       "bad_epochs": bad_epochs})
+
+    if stopped is not None:
+        skipped = epochs - stopped
+        mean_s = sum(epoch_times) / len(epoch_times) if epoch_times else 0.0
+        print(f"Early stopping at epoch {stopped}/{epochs}: val loss has not improved since epoch {best_epoch}, "
+              f"saved {skipped} epochs (~{skipped * mean_s:.1f}s)")
+    if best_state is not None:
+        model.load_state_dict(best_state)
+        if best_optimizer is not None:
+            optimizer.load_state_dict(best_optimizer)
+        print(f"Restored best weights from epoch {best_epoch} (val loss {best_loss:.4f})")
+
+    written = []  # 本次實際寫出的產物，只有這些會存進模型快取 (工作目錄裡可能還有上次留下的版本 / 網格)
+    if not streaming:
+        # 權重、optimizer 狀態、資料統計、舊資料樣本與已讀到的位元組位移，供下次增量訓練
+        if ckpt is not None:
+            stats = merge_stats(ckpt["stats"], data_stats(new[0], new[1]))
+            replay_x, replay_y = update_replay(replay_x, replay_y, ckpt["stats"]["count"], new_x, new_y)
+        else:
+            replay_x, replay_y = sample_replay(dataset.inputs, dataset.targets)
+        save_checkpoint(ckpt_path, {"model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                                    "hidden": list(hidden), "normalize": normalize, "stats": stats,
+                                    "replay_inputs": replay_x, "replay_targets": replay_y,
+                                    "watermark": make_watermark(jsonl_file, offset) if offset is not None else None})
+        written.append(ckpt_path)
+
+    if progress is not None:
+        progress({"type": "stage", "stage": "export"})
     dummy_input = torch.randn(1, 2)
-    torch.onnx.export(
-        model, dummy_input, save_path,
-        input_names=["input"], output_names=["trajectory"],
-        dynamic_axes={"input": {0: "batch"}, "trajectory": {0: "batch"}},
-        opset_version=11
-    )
+    export_model = model.folded()
+    export_start = time.time()
+    with metrics.timer("train.export_onnx"):
+        torch.onnx.export(
+            export_model, dummy_input, save_path,
+            input_names=["input"], output_names=["trajectory"],
+            dynamic_axes={"input": {0: "batch"}, "trajectory": {0: "batch"}},
+            opset_version=11
+        )
     print(f"Model saved as{save_path}")
+    export_npz(export_model, os.path.splitext(save_path)[0] + ".npz")
+    written += [save_path, os.path.splitext(save_path)[0] + ".npz"]
+    # 外部權重檔只在這次匯出有寫時才算 (權重內嵌時不會更新舊的 .data)
+    if os.path.exists(save_path + ".data") and os.path.getmtime(save_path + ".data") >= export_start - 1:
+        written.append(save_path + ".data")
+    if os.path.exists(run_path):
+        os.remove(run_path)
+    if variants:
+        # 另外輸出最佳化與 INT8 版本並產生精度 / 延遲報告；失敗不影響主要模型
+        if progress is not None:
+            progress({"type": "stage", "stage": "variants"})
+        try:
+            import export_variants
+            report = export_variants.export_variants(save_path, None if streaming else jsonl_file)
+            written += [v["path"] for v in report["variants"].values() if v["path"] != save_path]
+            written.append(os.path.splitext(save_path)[0] + ".variants.json")
+        except Exception as e:
+            print(f"Variant export skipped: {type(e).__name__}: {e}")
+    if grid:
+        # 預先算好整數位移的預測網格，測試時查表即可
+        if progress is not None:
+            progress({"type": "stage", "stage": "grid"})
+        try:
+            import test_model
+            import prediction_cache
+            print(f"Prediction grid saved -> {test_model.build_prediction_grid(save_path)}")
+            written += list(prediction_cache.grid_paths(save_path))
+        except Exception as e:
+            print(f"Prediction grid skipped: {type(e).__name__}: {e}")
+    if artifacts is not None:
+        records = len(dataset) if not streaming and ckpt is None else None
+        meta = artifacts.store(cache_key, save_path, written, {
+            "config": {"epochs": epochs, "batch_size": batch_size, "lr": lr, "hidden": list(hidden),
+                       "normalize": normalize, "incremental": ckpt is not None},
+            "datasets": [jsonl_file] if isinstance(jsonl_file, str) else list(jsonl_file),
+            "records": records, "val_loss": best_loss if best_state is not None else None})
+        print(f"Model cached as {cache_key[:12]} ({meta['bytes'] / 2 ** 20:.1f} MB)")
+    return save_path
 
 if __name__ == "__main__":
-    train_model("mouse_dataset.jsonl")
+    import argparse
+    parser = argparse.ArgumentParser(description="Train TrajNet and export it to ONNX")
+    parser.add_argument("dataset", nargs="?", default="mouse_dataset.jsonl")
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--hidden", default="64,128,64", help="comma-separated hidden layer widths")
+    parser.add_argument("--incremental", action="store_true", help="fine-tune on records added since the last run")
+    parser.add_argument("--patience", type=int, default=5, help="early-stopping patience in epochs (0 disables)")
+    parser.add_argument("--no-resume", action="store_true", help="ignore an interrupted run and start over")
+    parser.add_argument("--normalize", action="store_true",
+                        help="normalize inputs / outputs with dataset statistics (folded into the exported model)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always retrain instead of restoring a cached model with the same data and settings")
+    args = parser.parse_args()
+    train_model(args.dataset, epochs=args.epochs, batch_size=args.batch_size, lr=args.lr,
+                incremental=args.incremental, patience=args.patience, resume=not args.no_resume,
+                hidden=tuple(int(h) for h in args.hidden.split(",") if h), normalize=args.normalize,
+                cache=not args.no_cache)
@@ -0,0 +1,135 @@
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+# 在背景訓練模型並把進度傳回 GUI
+# 預設開一個子行程執行本檔案 (不用 multiprocessing，避免 spawn 時重新執行 main.py 開出第二個視窗)，
+# 子行程以一行一個 JSON 的方式在 stdout 回報進度，從 stdin 收到 "cancel" 時中止訓練
+
+class _JsonLineWriter:
+    # 子行程中的 print 全部包成 {"type": "log"} 訊息
+    def __init__(self, emit):
+        self.emit = emit
+
+    def write(self, text):
+        for line in text.splitlines():
+            if line.strip():
+                self.emit({"type": "log", "text": line})
+        return len(text)
+
+    def flush(self):
+        pass
+
+def _train(jsonl_file, kwargs, emit, cancel):
+    try:
+        import train_model
+        result = train_model.train_model(jsonl_file, progress=emit, cancel=cancel, **kwargs)
+        emit({"type": "cancelled"} if result is None else {"type": "done", "path": result})
+    except Exception as e:
+        emit({"type": "error", "text": f"{type(e).__name__}: {e}"})
+
+class TrainingJob:
+    def __init__(self, jsonl_file="mouse_dataset.jsonl", use_process=True, **kwargs):
+        self.messages = queue.Queue()
+        self.last_epoch = None
+        self.new_epochs = []  # 最近一次 poll 取出的所有 epoch 訊息
+        self.stage = "train"
+        self.result = None  # 結束時為 done / cancelled / error 訊息
+        self.use_process = use_process
+
+        if use_process:
+            cmd = [sys.executable, "-u", os.path.abspath(__file__), jsonl_file, json.dumps(kwargs)]
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT, text=True, encoding="utf-8",
+                                         errors="replace", bufsize=1)
+            self.worker = threading.Thread(target=self._read_process, daemon=True)
+        else:
+            self.proc = None
+            self.cancel_event = threading.Event()
+            self.worker = threading.Thread(target=_train, daemon=True,
+                                           args=(jsonl_file, kwargs, self.messages.put, self.cancel_event))
+        self.worker.start()
+
+    def _read_process(self):
+        for line in self.proc.stdout:
+            line = line.rstrip("\n")
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                msg = {"type": "log", "text": line}
+            if not isinstance(msg, dict):
+                msg = {"type": "log", "text": line}
+            self.messages.put(msg)
+        code = self.proc.wait()
+        self.messages.put({"type": "exit", "code": code})
+
+    def cancel(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.write("cancel\n")
+                self.proc.stdin.flush()
+            except OSError:
+                pass
+        else:
+            self.cancel_event.set()
+
+    @property
+    def running(self):
+        return self.result is None
+
+    def poll(self):
+        # 取出目前所有訊息 (非阻塞)，回傳要寫入日誌的文字
+        logs = []
+        self.new_epochs = []
+        while True:
+            try:
+                msg = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg.get("type")
+            if kind == "log":
+                logs.append(msg["text"])
+            elif kind == "epoch":
+                self.last_epoch = msg
+                self.new_epochs.append(msg)
+            elif kind == "stage":
+                self.stage = msg["stage"]
+            elif kind in ("done", "cancelled", "error"):
+                self.result = msg
+                if kind == "error":
+                    logs.append(f"Training failed: {msg['text']}")
+            elif kind == "exit" and self.result is None:
+                self.result = {"type": "error", "text": f"training process exited with code {msg['code']}"}
+                logs.append(f"Training failed: {self.result['text']}")
+        if self.result is not None and not self.use_process and self.worker.is_alive():
+            self.worker.join(0)
+        return logs
+
+def _child_main(jsonl_file, kwargs_json):
+    out = sys.stdout
+    lock = threading.Lock()
+
+    def emit(msg):
+        with lock:
+            out.write(json.dumps(msg) + "\n")
+            out.flush()
+
+    sys.stdout = sys.stderr = _JsonLineWriter(emit)
+    cancel = threading.Event()
+
+    def watch_stdin():
+        for line in sys.stdin:
+            if line.strip() == "cancel":
+                cancel.set()
+                return
+        # GUI 關閉時 stdin 會結束，此時也一併停止
+        cancel.set()
+
+    threading.Thread(target=watch_stdin, daemon=True).start()
+    _train(jsonl_file, json.loads(kwargs_json), emit, cancel)
+
+if __name__ == "__main__":
+    _child_main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "{}")